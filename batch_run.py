@@ -0,0 +1,85 @@
+import argparse
+import os
+import sys
+import time
+import traceback
+from model import Setup
+from project_file import load_project, save_project
+from result_cache import ResultCache, default_cache_dir
+
+# Runs saved projects without Qt or a display:
+#   python batch_run.py project.qxp [more.qxp ...] -o results/
+# Every simulation, its outputs and every sweep are computed, and each project is written back out
+# with its results filled in, so the result file opens in the GUI like any other project.
+
+
+def log(msg):
+    sys.stderr.write("[%s] %s\n" % (time.strftime("%H:%M:%S"), msg))
+    sys.stderr.flush()
+
+
+def log_status(msg):
+    if msg:
+        log("  " + msg)
+
+
+def run_setup(setup, cache=None, processes=None, sweeps=True):
+    for sim in setup.sims_item.items_list():
+        log("%s: simulating %s" % (setup.name(), sim.name()))
+        sim.run(cache, status_fn=log_status)
+        setup.compute_outputs(sim)
+    if sweeps:
+        for sweep in setup.sweeps_item.items_list():
+            log("%s: sweeping %s" % (setup.name(), sweep.name()))
+            sweep.run(processes, cache)
+
+
+def run_project(path, output_path, cache=None, processes=None, sweeps=True):
+    project = load_project(path)
+    setups = [Setup(state) for state in project["setups"]]
+    for setup in setups:
+        run_setup(setup, cache, processes, sweeps)
+    project["setups"] = [setup.save_state() for setup in setups]
+    save_project(output_path, project)
+
+
+def output_path_for(path, output_dir=None, suffix="_results"):
+    base, ext = os.path.splitext(os.path.basename(path))
+    if output_dir is None:
+        output_dir = os.path.dirname(os.path.abspath(path))
+    return os.path.join(output_dir, base + suffix + (ext or ".qxp"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run saved QuTiP Explorer projects headlessly")
+    parser.add_argument("projects", nargs="+", help="project files saved from the GUI")
+    parser.add_argument("-o", "--output-dir", help="where result projects are written (default: beside each input)")
+    parser.add_argument("--processes", type=int, default=None, help="pool size for sweeps (default: all cores)")
+    parser.add_argument("--cache-dir", default=default_cache_dir, help="result cache shared between runs")
+    parser.add_argument("--no-cache", action="store_true", help="always recompute")
+    parser.add_argument("--no-sweeps", action="store_true", help="only run simulations and their outputs")
+    args = parser.parse_args(argv)
+
+    if args.output_dir is not None and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    cache = None if args.no_cache else ResultCache(args.cache_dir)
+    # A failed project is reported and skipped, so one bad configuration does not stop an overnight batch
+    failed = []
+    for path in args.projects:
+        output_path = output_path_for(path, args.output_dir)
+        log("Running %s" % path)
+        try:
+            run_project(path, output_path, cache, args.processes, not args.no_sweeps)
+        except Exception:
+            traceback.print_exc()
+            failed.append(path)
+            continue
+        log("Wrote %s" % output_path)
+    if failed:
+        log("%d of %d projects failed: %s" % (len(failed), len(args.projects), ", ".join(failed)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
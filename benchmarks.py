@@ -0,0 +1,379 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import traceback
+from timeit import default_timer
+import numpy as np
+from formulas import VarGraph
+from model import Setup
+from timing import RunTimings
+import operators
+
+# Headless benchmarks of the simulation and output pipeline:
+#   python benchmarks.py -o bench_results.json
+#   python benchmarks.py --quick --compare bench_results.json
+# Each case is timed over several repeats and written as JSON together with the versions it ran
+# against, so results from two checkouts can be compared case by case.
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def field_state(fields):
+    # Item state as FormItem.save_state writes it, from (name, kind, value) triples
+    return {
+        "fields": [(name, str(value)) for name, _, value in fields],
+        "kinds": dict((name, kind) for name, kind, _ in fields),
+    }
+
+
+def mode_state(i, dimension):
+    return field_state([
+        ("name", "str", "Mode_%d" % i),
+        ("dimension", "int", dimension),
+        ("frequency", "float", 1 + 0.1*i),
+        ("anharmonicity", "float", 0.01),
+        ("decay", "float", 0.01),
+        ("dephasing", "float", 0),
+        ("drive_amplitude", "float", 0.1),
+        ("drive_angle_degrees", "float", 0),
+        ("fock_state", "int", 0),
+        ("initial_displacement", "float", 0.5),
+        ("leg_count", "int", 1),
+    ])
+
+
+def cross_mode_states(n_modes, cross_terms):
+    if cross_terms == "none" or n_modes < 2:
+        return []
+    if cross_terms == "matrix":
+        state = field_state([("name", "str", "Coupling_Matrix"), ("term_type", "str", "Cross-Kerr")])
+        state["coupling"] = np.triu(np.full((n_modes, n_modes), 0.001), 1)
+        return [("Cross-Mode Matrix", state)]
+    states = []
+    for i in range(n_modes):
+        for j in range(i + 1, n_modes):
+            states.append(("Cross-Mode Term", field_state([
+                ("name", "str", "Cross-Kerr(%d, %d)" % (i, j)),
+                ("term_type", "str", "Cross-Kerr"),
+                ("strength", "float", 0.001),
+                ("mode_1", ("item", "Modes"), "Mode_%d" % i),
+                ("mode_2", ("item", "Modes"), "Mode_%d" % j),
+            ])))
+    return states
+
+
+def pulse_state(duration):
+    return field_state([
+        ("name", "str", "Pulse_1"),
+        ("frequency", "float", 1),
+        ("amplitude", "float", 0.1),
+        ("phase", "float", 0),
+        ("profile", "str", "Gaussian"),
+        ("duration", "float", duration),
+        ("sigma", "float", duration / 4.),
+    ])
+
+
+def sequence_state(n_steps, duration):
+    # Pulses alternating with waits
+    fields = [("name", "str", "Sequence_1")]
+    for k in range(1, n_steps + 1):
+        if k % 2:
+            fields.append(("pulse_step_%d" % k, ("item", "Pulses"), "Pulse_1"))
+        else:
+            fields.append(("wait_step_%d" % k, "float", duration))
+    return field_state(fields)
+
+
+def simulation_state(time_step, compiled=True):
+    return field_state([
+        ("name", "str", "Simulation_1"),
+        ("sequence", ("item", "Pulse Sequences"), "Sequence_1"),
+        ("time_step", "float", time_step),
+        ("keep_full_states", "str", "In Memory"),
+        ("trace_processes", "int", 1),
+        ("solve_sequence_as", "str", "Single Compiled Solve" if compiled else "One Solve Per Step"),
+        ("frame", "str", "Lab"),
+        ("outputs_in_lab_frame", "str", "No"),
+        ("adaptive_truncation", "str", "Off"),
+        ("truncation_tolerance", "float", 1e-4),
+        ("solver", "str", "Master Equation"),
+        ("trajectories_per_batch", "int", 50),
+        ("max_trajectories", "int", 1000),
+        ("target_precision", "float", 1e-3),
+    ])
+
+
+def output_state(report_type, resolution):
+    return field_state([
+        ("name", "str", "Output_1"),
+        ("simulation", ("item", "Analysis"), "Simulation_1"),
+        ("mode", ("item", "Modes"), "Mode_0"),
+        ("report_type", "str", report_type),
+        ("wigner_range", "float", 5),
+        ("wigner_resolution", "int", resolution),
+        ("wigner_processes", "int", 1),
+    ])
+
+
+def setup_state(n_modes=2, dimension=4, cross_terms="pairs", n_steps=1, duration=1., time_step=0.1,
+                compiled=True, report_type="Wigner", resolution=50):
+    return {
+        "fields": [("name", "Setup")],
+        "kinds": {"name": "str"},
+        "variables": [],
+        "groups": [
+            [("Mode", mode_state(i, dimension)) for i in range(n_modes)],
+            cross_mode_states(n_modes, cross_terms),
+            [("Pulse", pulse_state(duration))],
+            [("Sequence", sequence_state(n_steps, duration))],
+            [("Simulation", simulation_state(time_step, compiled))],
+            [],
+            [("Output", output_state(report_type, resolution))],
+        ],
+    }
+
+
+def time_case(fn, reset=None, repeat=3):
+    seconds = []
+    for _ in range(repeat):
+        if reset is not None:
+            reset()
+        start = default_timer()
+        fn()
+        seconds.append(default_timer() - start)
+    return seconds
+
+
+def hamiltonian_cases(quick):
+    # Cold builds: the operator caches are emptied before every repeat
+    mode_counts = [2, 4] if quick else [2, 4, 6, 8]
+    dimensions = [3, 5] if quick else [3, 5, 8]
+    for cross_terms in ["pairs", "matrix"]:
+        for n_modes in mode_counts:
+            for dimension in dimensions:
+                if dimension ** n_modes > 2 * 10**5:
+                    continue
+                setup = Setup(setup_state(n_modes, dimension, cross_terms))
+
+                def reset(setup=setup):
+                    setup.modes_item.operator_cache = None
+                    operators.local_cache.clear()
+                params = {"modes": n_modes, "dimension": dimension, "cross_terms": cross_terms}
+                yield "hamiltonian", params, setup.hamiltonian, reset
+
+
+def simulation_cases(quick):
+    step_counts = [1, 4] if quick else [1, 4, 16]
+    time_steps = [0.1] if quick else [0.1, 0.01]
+    for compiled in [True, False]:
+        for n_steps in step_counts:
+            for time_step in time_steps:
+                setup = Setup(setup_state(n_steps=n_steps, time_step=time_step, compiled=compiled))
+                sim = setup.sims_item.items_list()[0]
+                params = {"steps": n_steps, "time_step": time_step, "compiled": compiled}
+                yield "simulation", params, lambda sim=sim: sim.run(), None
+
+
+def output_cases(quick):
+    resolutions = [25, 50] if quick else [25, 50, 100, 200]
+    cases = [("Wigner", r) for r in resolutions] + [("Expect-XYZ", 0)]
+    for report_type, resolution in cases:
+        setup = Setup(setup_state(report_type=report_type, resolution=resolution or 50, duration=5.))
+        sim = setup.sims_item.items_list()[0]
+        output = setup.outputs_item.items_list()[0]
+        # The reduced states this output needs are streamed during the run, as in the GUI
+        sim.run()
+        params = {"report_type": report_type, "resolution": resolution, "n_states": len(sim.states)}
+        yield "output", params, output.compute, None
+
+
+def variable_graph(depth, fan_out):
+    # depth layers of fan_out variables, each depending on every variable of the layer before
+    graph = VarGraph()
+    graph.set_formula("x", "1.0")
+    previous = ["x"]
+    for d in range(depth):
+        layer = ["v_%d_%d" % (d, i) for i in range(fan_out)]
+        for i, name in enumerate(layer):
+            graph.set_formula(name, "%d + (%s)/%d" % (i, " + ".join(previous), len(previous)))
+        previous = layer
+    return graph
+
+
+def variable_cases(quick):
+    depths = [4, 16] if quick else [4, 16, 64]
+    fan_outs = [1, 8] if quick else [1, 8, 32]
+    grid = np.linspace(0, 1, 101)
+    for depth in depths:
+        for fan_out in fan_outs:
+            graph = variable_graph(depth, fan_out)
+            values = itertools.count()
+            params = {"depth": depth, "fan_out": fan_out}
+            yield "variable update", params, lambda g=graph, v=values: g.set_formula("x", str(next(v))), None
+            yield "variable grid", dict(params, points=len(grid)), lambda g=graph: g.evaluate_grid({"x": grid}), None
+
+
+suites = [
+    ("hamiltonian", hamiltonian_cases),
+    ("simulation", simulation_cases),
+    ("output", output_cases),
+    ("variables", variable_cases),
+]
+
+
+def startup_seconds():
+    # Needs a display; reported by the GUI itself once its event loop is running
+    output = subprocess.check_output([sys.executable, os.path.join(here, "qutip_explorer.py"), "--startup-time"],
+                                     cwd=here)
+    for line in output.decode().splitlines():
+        if line.startswith("startup_seconds"):
+            return float(line.split()[1])
+    raise RuntimeError("qutip_explorer.py did not report its startup time")
+
+
+def environment():
+    def version(name):
+        try:
+            return __import__(name).__version__
+        except Exception:
+            return None
+    try:
+        with open(os.devnull, "w") as devnull:
+            revision = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=here, stderr=devnull).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": revision,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": version("numpy"),
+        "scipy": version("scipy"),
+        "qutip": version("qutip"),
+    }
+
+
+def case_key(case):
+    return case["suite"], case["case"], json.dumps(case["params"], sort_keys=True)
+
+
+def run_suites(names, quick=False, repeat=3, log=None):
+    cases = []
+    for suite, case_fn in suites:
+        if suite not in names:
+            continue
+        generator = case_fn(quick)
+        while True:
+            # A failing case (or case setup) is recorded and the rest of the suite still runs
+            record = {"suite": suite}
+            try:
+                name, params, fn, reset = next(generator)
+            except StopIteration:
+                break
+            except Exception:
+                record.update(case="setup", params={}, error=traceback.format_exc())
+                cases.append(record)
+                if log is not None:
+                    log(record)
+                break
+            record.update(case=name, params=params)
+            try:
+                seconds = time_case(fn, reset, repeat)
+            except Exception:
+                record["error"] = traceback.format_exc()
+            else:
+                record.update(seconds=seconds, min_seconds=min(seconds), median_seconds=float(np.median(seconds)))
+            cases.append(record)
+            if log is not None:
+                log(record)
+    return cases
+
+
+def stage_breakdown():
+    # One instrumented run, so a regression in a simulation case can be traced to its stage
+    setup = Setup(setup_state(n_steps=4))
+    sim = setup.sims_item.items_list()[0]
+    timings = RunTimings(sim.name())
+    sim.run(timings=timings)
+    setup.compute_outputs(sim, timings)
+    return timings.as_dict()
+
+
+def compare(cases, baseline_cases, threshold):
+    baseline = dict((case_key(c), c) for c in baseline_cases if "min_seconds" in c)
+    rows = []
+    for case in cases:
+        old = baseline.get(case_key(case))
+        if old is None or "min_seconds" not in case:
+            continue
+        ratio = case["min_seconds"] / old["min_seconds"] if old["min_seconds"] else float("inf")
+        rows.append((ratio, case))
+    regressions = 0
+    for ratio, case in rows:
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  SLOWER"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        sys.stdout.write("%-12s %-16s %-60s %6.2fx%s\n" % (case["suite"], case["case"],
+                                                          json.dumps(case["params"], sort_keys=True), ratio, flag))
+    return regressions
+
+
+def log_case(case):
+    if "error" in case:
+        status = "FAILED: " + case["error"].strip().splitlines()[-1]
+    else:
+        status = "%.4f s" % case["min_seconds"]
+    sys.stderr.write("%-12s %-16s %s  %s\n" % (case["suite"], case["case"],
+                                                json.dumps(case["params"], sort_keys=True), status))
+
+
+def main(argv=None):
+    suite_names = [name for name, _ in suites]
+    parser = argparse.ArgumentParser(description="Benchmark the simulation and output pipeline without a display")
+    parser.add_argument("suites", nargs="*", help="any of %s (default: all)" % ", ".join(suite_names))
+    parser.add_argument("-o", "--output", default="bench_results.json", help="where the results are written")
+    parser.add_argument("--quick", action="store_true", help="smaller parameter grids")
+    parser.add_argument("--repeat", type=int, default=3, help="timed repeats per case (the minimum is compared)")
+    parser.add_argument("--startup", action="store_true", help="also time GUI startup (needs a display)")
+    parser.add_argument("--compare", help="earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative change reported as a regression")
+    args = parser.parse_args(argv)
+    unknown = set(args.suites) - set(suite_names)
+    if unknown:
+        parser.error("unknown suites: %s" % ", ".join(sorted(unknown)))
+
+    results = {"environment": environment(), "quick": args.quick, "repeat": args.repeat}
+    results["cases"] = run_suites(args.suites or suite_names, args.quick, args.repeat, log_case)
+    try:
+        results["stages"] = stage_breakdown()
+    except Exception:
+        results["stages"] = {"error": traceback.format_exc()}
+    if args.startup:
+        try:
+            results["startup_seconds"] = startup_seconds()
+        except Exception:
+            results["startup_seconds"] = None
+            traceback.print_exc()
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    sys.stderr.write("Wrote %s\n" % args.output)
+
+    failed = sum("error" in c for c in results["cases"])
+    regressions = 0
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results["cases"], json.load(f)["cases"], args.threshold)
+    return 1 if failed or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,480 @@
+import re
+from multiprocessing import Pool, TimeoutError, cpu_count, current_process
+from numpy import arange, array, empty, zeros, sqrt, real
+from qutip import mesolve, sesolve, mcsolve, ket2dm, expect, Options, Qobj
+from qutip.ui.progressbar import BaseProgressBar
+from result_cache import snapshot_key
+from state_store import StateStore
+from timing import timed
+
+
+class ComputeCancelled(Exception):
+    pass
+
+
+class Reductions(object):
+    # What outputs need from each step, computed inside the solver so full states need not be stored
+    def __init__(self, keep_states=False, states_on_disk=False):
+        self.keep_states = keep_states
+        self.states_on_disk = states_on_disk
+        self.ptrace_indices = []
+        self.expect_ops = {}
+
+    def add_ptrace(self, index):
+        if index not in self.ptrace_indices:
+            self.ptrace_indices.append(index)
+
+    def add_expect(self, key, op):
+        self.expect_ops[key] = op
+
+    def key_items(self):
+        return [self.keep_states, self.states_on_disk, sorted(self.ptrace_indices), sorted(self.expect_ops.items())]
+
+
+class SimulationSnapshot(object):
+    # Everything needed to run a simulation, detached from the Qt items so it can be handed to a worker
+    # h0 is a Qobj or a qutip list-format Hamiltonian whose coefficients read h0_args. Each step is
+    # (terms, duration, args), terms being a list of [operator, coefficient string] pairs or None
+    def __init__(self, h0, init_state, collapse_ops, steps, time_step, reductions=None, compiled=False,
+                 h0_args=None, monte_carlo=None):
+        self.h0 = h0
+        self.h0_args = {} if h0_args is None else h0_args
+        self.monte_carlo = monte_carlo
+        self.init_state = init_state
+        self.collapse_ops = collapse_ops
+        self.steps = steps
+        self.time_step = time_step
+        self.reductions = reductions
+        self.compiled = compiled
+
+
+def ptrace_index(state, index):
+    # index is a mode's tensor index, or a tuple of them for multi-mode reductions
+    if isinstance(index, tuple):
+        return state.ptrace(list(index))
+    return state.ptrace(index)
+
+
+def reduce_states_job(job):
+    states, indices = job
+    return dict((index, [ptrace_index(s, index) for s in states]) for index in indices)
+
+
+def reduce_states(states, indices, processes=1, chunk_size=64, progress_fn=None):
+    # One pass over states (each loaded once, even from a StateStore) for all requested indices
+    reduced = dict((index, []) for index in indices)
+    if not indices:
+        return reduced
+    jobs = ((states[start:start + chunk_size], indices) for start in range(0, len(states), chunk_size))
+    pool = None
+    if processes > 1 and len(states) > chunk_size:
+        pool = Pool(processes)
+        chunks = pool.imap(reduce_states_job, jobs)
+    else:
+        chunks = (reduce_states_job(job) for job in jobs)
+    try:
+        n_done = 0
+        for chunk in chunks:
+            for index in indices:
+                reduced[index].extend(chunk[index])
+            n_done += len(chunk[indices[0]])
+            if progress_fn is not None:
+                progress_fn(float(n_done) / len(states))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return reduced
+
+
+class SimulationResult(object):
+    def __init__(self, states=None):
+        self.times = []
+        # Any sequence of states: a plain list, or a StateStore spooled to disk
+        self.states = [] if states is None else states
+        self.reduced = {}
+        self.expect = {}
+        # Only filled for Monte Carlo runs: standard errors of the expectation values
+        self.expect_errors = {}
+        self.n_trajectories = None
+
+    def add_reductions(self, state, reductions):
+        for index in reductions.ptrace_indices:
+            self.reduced.setdefault(index, []).append(ptrace_index(state, index))
+        for key, op in reductions.expect_ops.items():
+            self.expect.setdefault(key, []).append(expect(op, state))
+
+
+class CallbackProgressBar(BaseProgressBar):
+    # The solvers report every output time through their progress bar, which is the
+    # only hook we get inside a step, so cancellation is checked there too
+    def __init__(self, progress_fn=None, is_cancelled=None):
+        super(CallbackProgressBar, self).__init__()
+        self.progress_fn = progress_fn
+        self.is_cancelled = is_cancelled
+
+    def start(self, iterations, **kwargs):
+        self.N = float(iterations)
+
+    def update(self, n):
+        if self.is_cancelled is not None and self.is_cancelled():
+            raise ComputeCancelled()
+        if self.progress_fn is not None:
+            self.progress_fn(n / self.N)
+
+    def finished(self):
+        pass
+
+
+def evolve(hamiltonian, init_state, time_list, collapse_ops, e_ops, args, options, progress_bar):
+    # Without dissipation a ket can be evolved directly, costing N instead of N**2 per state
+    if not collapse_ops and init_state.isket:
+        return sesolve(hamiltonian, init_state, time_list, e_ops, args,
+                       options=options, progress_bar=progress_bar)
+    if init_state.isket:
+        init_state = ket2dm(init_state)
+    return mesolve(hamiltonian, init_state, time_list, collapse_ops, e_ops, args,
+                   options=options, progress_bar=progress_bar)
+
+
+def solve_step(hamiltonian, init_state, time_list, collapse_ops, args, reductions, progress_bar, result,
+               options=None):
+    # Appends the step's output to result and returns the final state to chain the next step from
+    if options is None:
+        options = Options()
+    result.times.extend(time_list)
+    if reductions is None or (reductions.keep_states and not reductions.states_on_disk):
+        states = evolve(hamiltonian, init_state, time_list, collapse_ops, [], args,
+                        options, progress_bar).states
+        result.states.extend(states)
+        return states[-1]
+
+    # A callable e_ops is handed each state as it is produced, and the solver then keeps no states itself
+    def process_state(t, state):
+        if reductions.keep_states:
+            result.states.append(state)
+        result.add_reductions(state, reductions)
+
+    options.store_final_state = True
+    output = evolve(hamiltonian, init_state, time_list, collapse_ops, process_state, args,
+                    options, progress_bar)
+    return output.final_state
+
+
+def combine_hamiltonian(h0, terms):
+    if not terms:
+        return h0
+    if isinstance(h0, list):
+        return h0 + terms
+    return [h0] + terms
+
+
+def rename_args(td_str, names, suffix):
+    for name in names:
+        td_str = re.sub(r"\b%s\b" % name, name + suffix, td_str)
+    return td_str
+
+
+class CompiledSequence(object):
+    # The whole sequence as one time-dependent Hamiltonian: each pulse step becomes a term of its
+    # operator's coefficient string, switched on by (t_on_k <= t < t_off_k). Steps sharing a pulse
+    # shape (coefficient template and args) share one set of renamed args, so the coefficient
+    # strings depend only on the sequence structure and compile to the same code between runs.
+    def __init__(self, snapshot):
+        self.times = []
+        self.args = dict(snapshot.h0_args)
+        self.shapes = {}
+        operators = []
+        coefficients = []
+        start_time = 0
+        for k, (h1, duration, step_args) in enumerate(snapshot.steps):
+            end_time = start_time + duration
+            self.times.extend(arange(start_time, end_time, snapshot.time_step))
+            if h1 is not None:
+                self.args["t_on_%d" % k] = start_time
+                self.args["t_off_%d" % k] = end_time
+            for op, td_str in h1 or []:
+                coefficient = "(t >= t_on_%d)*(t < t_off_%d)*(%s)" % (k, k, self.shape(td_str, step_args))
+                for i, other in enumerate(operators):
+                    if other is op or other == op:
+                        coefficients[i].append(coefficient)
+                        break
+                else:
+                    operators.append(op)
+                    coefficients.append([coefficient])
+            start_time = end_time
+
+        terms = [[op, " + ".join(c)] for op, c in zip(operators, coefficients)]
+        self.hamiltonian = combine_hamiltonian(snapshot.h0, terms)
+        # Keep the integrator from stepping over a whole pulse or wait
+        self.max_step = min(duration for _, duration, _ in snapshot.steps)
+
+    def shape(self, td_str, step_args):
+        key = (td_str, tuple(sorted(step_args.items())))
+        if key not in self.shapes:
+            suffix = "_%d" % len(self.shapes)
+            self.shapes[key] = suffix
+            for name, value in step_args.items():
+                self.args[name + suffix] = value
+        return rename_args(td_str, step_args, self.shapes[key])
+
+
+def new_result(snapshot):
+    if snapshot.reductions is not None and snapshot.reductions.states_on_disk:
+        return SimulationResult(StateStore())
+    return SimulationResult()
+
+
+def run_compiled(snapshot, progress_fn=None, status_fn=None, step_fn=None, is_cancelled=None, timings=None):
+    with timed(timings, "compile sequence"):
+        sequence = CompiledSequence(snapshot)
+    result = new_result(snapshot)
+    if status_fn is not None:
+        status_fn("Computing States for %d Steps..." % len(snapshot.steps))
+    progress_bar = CallbackProgressBar(progress_fn, is_cancelled)
+    options = Options(max_step=sequence.max_step)
+    with timed(timings, "solve (compiled)"):
+        solve_step(sequence.hamiltonian, snapshot.init_state, sequence.times, snapshot.collapse_ops, sequence.args,
+                   snapshot.reductions, progress_bar, result, options)
+    if timings is not None:
+        timings.record_states(result.states)
+    if step_fn is not None:
+        step_fn(len(snapshot.steps) - 1, result)
+    return result
+
+
+class MonteCarloSettings(object):
+    def __init__(self, batch_size=50, max_trajectories=1000, target_precision=1e-3):
+        self.batch_size = max(2, batch_size)
+        self.max_trajectories = max_trajectories
+        self.target_precision = target_precision
+
+    def key_items(self):
+        return [self.batch_size, self.max_trajectories, self.target_precision]
+
+
+class TrajectoryAverages(object):
+    # Running sums over trajectories of everything the outputs asked for
+    def __init__(self, reductions):
+        self.reductions = reductions
+        self.n = 0
+        self.dims = {}
+        self.sums = {}
+        self.square_sums = {}
+        self.state_sum = None
+        self.state_dims = None
+
+    def accumulate(self, key, values):
+        if key not in self.sums:
+            self.sums[key] = zeros(values.shape, dtype=values.dtype)
+            self.square_sums[key] = zeros(values.shape)
+        self.sums[key] += values
+        self.square_sums[key] += abs(values) ** 2
+
+    def add_trajectory(self, states):
+        self.n += 1
+        for index in self.reductions.ptrace_indices:
+            reduced = [ptrace_index(s, index) for s in states]
+            self.dims[index] = reduced[0].dims
+            self.accumulate(("reduced", index), array([r.full() for r in reduced]))
+        for key, op in self.reductions.expect_ops.items():
+            self.accumulate(("expect", key), real(array([expect(op, s) for s in states])))
+        if self.reductions.keep_states:
+            rhos = array([ket2dm(s).full() for s in states])
+            self.state_dims = [states[0].dims[0], states[0].dims[0]]
+            if self.state_sum is None:
+                self.state_sum = zeros(rhos.shape, dtype=complex)
+            self.state_sum += rhos
+            # Only the populations are tracked for convergence, the state sum has no spread of its own
+            self.accumulate(("populations", None), real(rhos.diagonal(axis1=1, axis2=2)))
+
+    def standard_error(self, key):
+        mean = self.sums[key] / self.n
+        variance = (self.square_sums[key] / self.n - abs(mean) ** 2) * self.n / (self.n - 1)
+        return sqrt(abs(variance) / self.n)
+
+    def precision(self):
+        # Largest standard error over expectation values and populations of reduced and full states.
+        # With nothing to check the run is never converged, and continues to max_trajectories
+        if self.n < 2 or not self.sums:
+            return float("inf")
+        errors = []
+        for key in self.sums:
+            error = self.standard_error(key)
+            if key[0] == "reduced":
+                error = array([e.diagonal() for e in error])
+            errors.append(error.max())
+        return max(errors)
+
+    def result(self, times):
+        result = SimulationResult()
+        result.times = list(times)
+        result.n_trajectories = self.n
+        for index in self.reductions.ptrace_indices:
+            result.reduced[index] = [Qobj(rho, dims=self.dims[index]) for rho in self.sums[("reduced", index)] / self.n]
+        for key in self.reductions.expect_ops:
+            result.expect[key] = list(self.sums[("expect", key)] / self.n)
+            if self.n > 1:
+                result.expect_errors[key] = list(self.standard_error(("expect", key)))
+        if self.state_sum is not None:
+            result.states = [Qobj(rho, dims=self.state_dims) for rho in self.state_sum / self.n]
+        return result
+
+
+def run_monte_carlo(snapshot, progress_fn=None, status_fn=None, step_fn=None, is_cancelled=None, timings=None):
+    # Quantum-jump trajectories in batches; each mcsolve call spreads its batch over all cores.
+    # Stops once the ensemble averages reach the target precision or the trajectory budget runs out.
+    settings = snapshot.monte_carlo
+    if not snapshot.init_state.isket:
+        raise ValueError("Monte Carlo trajectories need a pure initial state")
+    reductions = snapshot.reductions
+    if reductions is None:
+        reductions = Reductions(keep_states=True)
+    sequence = CompiledSequence(snapshot)
+    averages = TrajectoryAverages(reductions)
+    options = Options(max_step=sequence.max_step)
+    if current_process().daemon:
+        # Already a sweep point in a pool worker, which cannot start a pool of its own
+        options.num_cpus = 1
+    result = None
+    batch = 0
+    while averages.n < settings.max_trajectories:
+        if is_cancelled is not None and is_cancelled():
+            raise ComputeCancelled()
+        n_traj = max(2, min(settings.batch_size, settings.max_trajectories - averages.n))
+        if status_fn is not None:
+            status_fn("Running Trajectories %d-%d..." % (averages.n + 1, averages.n + n_traj))
+        with timed(timings, "mcsolve batch"):
+            output = mcsolve(sequence.hamiltonian, snapshot.init_state, sequence.times, snapshot.collapse_ops, [],
+                             ntraj=n_traj, args=sequence.args, options=options, progress_bar=BaseProgressBar())
+        with timed(timings, "trajectory averages"):
+            for trajectory in output.states:
+                averages.add_trajectory(trajectory)
+            result = averages.result(sequence.times)
+        if timings is not None:
+            timings.record_states(result.states)
+        if step_fn is not None:
+            step_fn(batch, result)
+        if progress_fn is not None:
+            progress_fn(float(averages.n) / settings.max_trajectories)
+        if averages.precision() < settings.target_precision:
+            break
+        batch += 1
+    return result
+
+
+def run_sequence(snapshot, progress_fn=None, status_fn=None, step_fn=None, is_cancelled=None, timings=None):
+    if snapshot.monte_carlo is not None:
+        return run_monte_carlo(snapshot, progress_fn, status_fn, step_fn, is_cancelled, timings)
+    if snapshot.compiled:
+        return run_compiled(snapshot, progress_fn, status_fn, step_fn, is_cancelled, timings)
+    init_state = snapshot.init_state
+    n_steps = len(snapshot.steps)
+    start_time = 0
+    result = new_result(snapshot)
+    for i, (h1, duration, args) in enumerate(snapshot.steps):
+        if is_cancelled is not None and is_cancelled():
+            raise ComputeCancelled()
+        end_time = start_time + duration
+        time_list = arange(start_time, end_time, snapshot.time_step)
+        hamiltonian = combine_hamiltonian(snapshot.h0, h1)
+        step_args = dict(snapshot.h0_args)
+        step_args.update(args)
+        if status_fn is not None:
+            status_fn("Computing States for Step %d..." % (i+1))
+        step_progress = None
+        if progress_fn is not None:
+            step_progress = lambda f, i=i: progress_fn((i + f) / n_steps)
+        progress_bar = CallbackProgressBar(step_progress, is_cancelled)
+        with timed(timings, "solve step %d" % (i+1)):
+            init_state = solve_step(hamiltonian, init_state, time_list, snapshot.collapse_ops, step_args,
+                                    snapshot.reductions, progress_bar, result)
+        if timings is not None:
+            timings.record_states(result.states)
+        if step_fn is not None:
+            step_fn(i, result)
+        start_time = end_time
+    return result
+
+
+def run_cached(snapshot, cache=None, **kwargs):
+    if cache is None:
+        return run_sequence(snapshot, **kwargs)
+    timings = kwargs.get("timings")
+    key = snapshot_key(snapshot)
+    with timed(timings, "cache lookup"):
+        result = cache.get(key)
+    if result is None:
+        result = run_sequence(snapshot, **kwargs)
+        with timed(timings, "cache store"):
+            cache.put(key, result)
+    return result
+
+
+def run_snapshot(job):
+    # Module level so it can be pickled into pool workers
+    snapshot, cache = job
+    result = run_cached(snapshot, cache)
+    if hasattr(result.states, "hand_over"):
+        # States spooled to disk outlive this worker; the copy sent back to the parent removes them
+        result.states.hand_over()
+    return result
+
+
+class SweepResult(object):
+    def __init__(self, values, times, results):
+        self.values = values
+        self.times = times
+        self.results = results
+        # Each array below is indexed by [sweep point, time]
+        self.states = None
+        if len(results[0].states):
+            self.states = self.stack([r.states for r in results])
+        self.reduced = dict((index, self.stack([r.reduced[index] for r in results]))
+                            for index in results[0].reduced)
+        self.expect = dict((key, array([r.expect[key] for r in results]))
+                           for key in results[0].expect)
+
+    def stack(self, rows):
+        stacked = empty((len(rows), len(self.times)), dtype=object)
+        for i, row in enumerate(rows):
+            for j, s in enumerate(row):
+                stacked[i, j] = s
+        return stacked
+
+
+def run_sweep(snapshots, values=None, processes=None, cache=None, progress_fn=None, point_fn=None, is_cancelled=None):
+    if not snapshots:
+        raise ValueError("Sweep has no points to run")
+    if processes is None:
+        processes = cpu_count()
+    processes = max(1, min(processes, len(snapshots)))
+    pool = Pool(processes)
+    results = []
+    try:
+        result_iter = pool.imap(run_snapshot, [(s, cache) for s in snapshots])
+        for i in range(len(snapshots)):
+            while True:
+                if is_cancelled is not None and is_cancelled():
+                    raise ComputeCancelled()
+                try:
+                    result = result_iter.next(0.1)
+                    break
+                except TimeoutError:
+                    pass
+            results.append(result)
+            if point_fn is not None:
+                point_fn(i, result)
+            if progress_fn is not None:
+                progress_fn(float(i + 1) / len(snapshots))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    times = results[0].times
+    if any(len(r.times) != len(times) for r in results):
+        raise ValueError("Sweep points produced different time grids")
+    return SweepResult(values, times, results)
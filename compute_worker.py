@@ -0,0 +1,89 @@
+from PyQt4.QtCore import QObject, QThread, pyqtSignal
+from compute_engine import run_cached, run_sweep, ComputeCancelled
+
+
+class Worker(QObject):
+    progress = pyqtSignal(float)
+    status = pyqtSignal(str)
+    finished = pyqtSignal(object)
+    cancelled = pyqtSignal()
+    failed = pyqtSignal(str)
+    done = pyqtSignal()
+
+    def __init__(self):
+        super(Worker, self).__init__()
+        # Subclasses define work(), run on the worker thread to return the result. ABCMeta can't be
+        # mixed with QObject's metaclass, so a missing override is caught here rather than in run()
+        if not callable(getattr(self, "work", None)):
+            raise TypeError("%s does not define work()" % type(self).__name__)
+        self.cancel_requested = False
+        self.thread = None
+
+    def cancel(self):
+        # Polled from the worker thread by the running job
+        self.cancel_requested = True
+
+    def is_cancelled(self):
+        return self.cancel_requested
+
+    def run(self):
+        try:
+            result = self.work()
+        except ComputeCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.finished.emit(result)
+        finally:
+            self.done.emit()
+
+    def start(self):
+        self.thread = QThread()
+        self.moveToThread(self.thread)
+        self.thread.started.connect(self.run)
+        self.done.connect(self.thread.quit)
+        self.thread.start()
+
+
+class ComputeWorker(Worker):
+    step_computed = pyqtSignal(int, object)
+
+    def __init__(self, snapshot, cache=None, timings=None):
+        super(ComputeWorker, self).__init__()
+        self.snapshot = snapshot
+        self.cache = cache
+        self.timings = timings
+
+    def work(self):
+        return run_cached(
+            self.snapshot,
+            self.cache,
+            progress_fn=self.progress.emit,
+            status_fn=self.status.emit,
+            step_fn=self.step_computed.emit,
+            is_cancelled=self.is_cancelled,
+            timings=self.timings,
+        )
+
+
+class SweepWorker(Worker):
+    point_computed = pyqtSignal(int, object)
+
+    def __init__(self, snapshots, values, processes=None, cache=None):
+        super(SweepWorker, self).__init__()
+        self.snapshots = snapshots
+        self.values = values
+        self.processes = processes
+        self.cache = cache
+
+    def work(self):
+        return run_sweep(
+            self.snapshots,
+            values=self.values,
+            processes=self.processes,
+            cache=self.cache,
+            progress_fn=self.progress.emit,
+            point_fn=self.point_computed.emit,
+            is_cancelled=self.is_cancelled,
+        )
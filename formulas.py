@@ -0,0 +1,124 @@
+import ast
+import numpy as np
+
+
+class Formula(object):
+    # Parsed and compiled once per distinct text, shared by every Formula instance
+    compiled = {}
+
+    def __init__(self, text):
+        self.text = text
+        if text not in Formula.compiled:
+            tree = ast.parse(text, mode="eval")
+            deps = frozenset(s.id for s in ast.walk(tree) if isinstance(s, ast.Name))
+            Formula.compiled[text] = compile(tree, "<formula>", "eval"), deps
+        self.code, self.deps = Formula.compiled[text]
+
+    def dependencies(self):
+        return self.deps
+
+    def evaluate(self, context):
+        # Values may be numpy arrays, in which case the result is evaluated elementwise
+        return eval(self.code, {}, context)
+
+
+class VarGraph(object):
+    # Flat dependency graph of variables, kept in topological order with cached values
+    def __init__(self):
+        self.formulas = {}
+        self.dependencies = {}
+        self.dependents = {}
+        self.values = {}
+        self.order = []
+
+    def __contains__(self, name):
+        return name in self.formulas
+
+    def names(self):
+        return list(self.order)
+
+    def value(self, name):
+        return self.values[name]
+
+    def downstream(self, name):
+        seen = set([name])
+        stack = [name]
+        while stack:
+            for dep in self.dependents.get(stack.pop(), ()):
+                if dep not in seen:
+                    seen.add(dep)
+                    stack.append(dep)
+        return seen
+
+    def set_formula(self, name, formula):
+        if not isinstance(formula, Formula):
+            formula = Formula(formula)
+        deps = formula.dependencies()
+        for dep in deps:
+            if dep not in self.formulas:
+                raise KeyError(dep)
+        downstream = self.downstream(name)
+        if deps & downstream:
+            raise ValueError("Cycle Detected")
+
+        old_deps = self.dependencies.get(name)
+        if old_deps is not None:
+            for dep in old_deps:
+                self.dependents[dep].discard(name)
+        for dep in deps:
+            self.dependents.setdefault(dep, set()).add(name)
+        self.formulas[name] = formula
+        self.dependencies[name] = deps
+        if old_deps != deps:
+            self.sort()
+        return self.update(name, downstream)
+
+    def sort(self):
+        n_deps = dict((name, len(deps)) for name, deps in self.dependencies.items())
+        ready = sorted(name for name, n in n_deps.items() if n == 0)
+        order = []
+        while ready:
+            name = ready.pop()
+            order.append(name)
+            for dep in self.dependents.get(name, ()):
+                n_deps[dep] -= 1
+                if n_deps[dep] == 0:
+                    ready.append(dep)
+        self.order = order
+
+    def update(self, name, downstream):
+        # Walk the downstream variables in order, skipping those none of whose inputs changed value
+        changed = set()
+        for var in self.order:
+            if var not in downstream:
+                continue
+            if var != name and not (self.dependencies[var] & changed):
+                continue
+            value = self.formulas[var].evaluate(self.context(self.dependencies[var]))
+            if var == name or self.values.get(var) != value:
+                self.values[var] = value
+                changed.add(var)
+        return changed
+
+    def context(self, names, values=None):
+        if values is None:
+            values = self.values
+        return dict((n, values[n]) for n in names)
+
+    def evaluate(self, formula, values=None):
+        if not isinstance(formula, Formula):
+            formula = Formula(formula)
+        return formula.evaluate(self.context(formula.dependencies(), values))
+
+    def evaluate_grid(self, overrides):
+        # Vectorized evaluation: overrides map variable names to arrays, and everything
+        # downstream of them is computed over the whole array in one pass
+        values = dict(self.values)
+        values.update((name, np.asarray(vals)) for name, vals in overrides.items())
+        touched = set(overrides)
+        for var in self.order:
+            if var in overrides or not (self.dependencies[var] & touched):
+                continue
+            values[var] = self.formulas[var].evaluate(self.context(self.dependencies[var], values))
+            touched.add(var)
+        return values
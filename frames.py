@@ -0,0 +1,27 @@
+from numpy import indices, dot, exp, real, imag, asarray
+from qutip import Qobj
+
+
+def frame_phases(dims, frequencies):
+    # sum_j nu_j n_j for every element of the product Fock basis
+    n = indices(dims).reshape(len(dims), -1)
+    return dot(frequencies, n)
+
+
+def to_lab_frame(states, times, frequencies):
+    # Undo U = exp(i sum_j nu_j n_j t): psi_lab = U^dag psi, rho_lab = U^dag rho U
+    lab_states = []
+    for s, t in zip(states, times):
+        rot = exp(-1j * frame_phases(s.dims[0], frequencies) * t)
+        if s.isket:
+            data = rot[:, None] * s.full()
+        else:
+            data = rot[:, None] * s.full() * rot.conj()[None, :]
+        lab_states.append(Qobj(data, dims=s.dims))
+    return lab_states
+
+
+def lab_frame_quadratures(x, y, times, frequency):
+    # X = 2 Re<a>, Y = -2 Im<a>, and <a> picks up exp(-i nu t) going back to the lab frame
+    a = 0.5 * (asarray(x) - 1j * asarray(y)) * exp(-1j * frequency * asarray(times))
+    return 2 * real(a), -2 * imag(a)
@@ -1,8 +1,11 @@
-import ast
-from PyQt4.QtCore import QAbstractTableModel, Qt, pyqtSignal, QObject, QPoint
+import numpy as np
+from PyQt4.QtCore import QAbstractTableModel, Qt, pyqtSignal, QObject, QPoint, QTimer
 from PyQt4.QtGui import QStandardItem, QComboBox, QSpinBox, QDoubleSpinBox, QCheckBox, QStandardItemModel, QTableView, \
     QStyledItemDelegate, QMenu, QAction, QDialog, QVBoxLayout, QDialogButtonBox, QTreeView, QLabel, QPixmap, QMessageBox, \
     QLineEdit
+from formulas import Formula, VarGraph
+from pixmap_cache import PixmapCache
+from model import FieldValues
 
 
 def print_fn(*s):
@@ -29,62 +32,83 @@ def error_message(message, title=None, warning=False):
     message_box.exec_()
 
 class ArrayModel(QAbstractTableModel):
-    def __init__(self, array=None):
+    def __init__(self, array=None, dtype=float):
         super(ArrayModel, self).__init__()
-        self.dtype = float
+        self.dtype = dtype
+        self.labels = None
         if array is None:
-            self.array = []
+            self.array = np.zeros((0, 0), dtype=dtype)
         else:
-            self.array = array
+            self.array = np.array(array, dtype=dtype)
 
     def rowCount(self, *args, **kwargs):
-        return len(self.array)
+        return self.array.shape[0]
 
     def columnCount(self, *args, **kwargs):
-        try:
-            return max(map(len, self.array))
-        except ValueError:
-            return 0
+        return self.array.shape[1]
+
+    def is_editable(self, i, j):
+        return True
 
     def data(self, idx, role=None):
-        if role == Qt.DisplayRole:
+        if role in (Qt.DisplayRole, Qt.EditRole):
             i, j = idx.row(), idx.column()
-            try:
-                return str(self.array[i][j])
-            except IndexError:
-                return "-"
+            if self.is_editable(i, j):
+                return str(self.array[i, j])
+            return "-"
 
     def setData(self, idx, val, role=None):
         if role == Qt.EditRole:
             i, j = idx.row(), idx.column()
-            self.array[i][j] = self.dtype(str(val.toString()))
+            self.array[i, j] = self.dtype(str(val.toString()))
+            self.dataChanged.emit(idx, idx)
             return True
         else:
             return False
 
     def flags(self, idx):
         f = super(ArrayModel, self).flags(idx)
-        i, j = idx.row(), idx.column()
-        if i < len(self.array) and j < len(self.array[i]):
+        if self.is_editable(idx.row(), idx.column()):
             return f | Qt.ItemIsEditable
         else:
             return f
 
+    def headerData(self, section, orientation, role=None):
+        if role == Qt.DisplayRole and self.labels is not None and section < len(self.labels):
+            return self.labels[section]
+        return super(ArrayModel, self).headerData(section, orientation, role)
+
+    def set_header_labels(self, labels):
+        self.labels = [str(l) for l in labels]
+        if not self.labels:
+            return
+        self.headerDataChanged.emit(Qt.Horizontal, 0, len(self.labels) - 1)
+        self.headerDataChanged.emit(Qt.Vertical, 0, len(self.labels) - 1)
+
+    def set_array(self, array):
+        self.beginResetModel()
+        self.array = np.array(array, dtype=self.dtype)
+        self.endResetModel()
+
 
 class UpperHalfArrayModel(ArrayModel):
-    def __init__(self):
-        super(UpperHalfArrayModel, self).__init__()
-        self.n = 0
+    # Square matrix of pair couplings; only entries above the diagonal are shown and edited
+    def is_editable(self, i, j):
+        return j > i
 
     def set_n(self, n):
-        while n > self.n:
-            self.n += 1
-            self.array.append([0]*self.n)
+        if n == self.array.shape[0]:
+            return
+        # Couplings between the modes that remain are kept
+        array = np.zeros((n, n), dtype=self.dtype)
+        m = min(n, self.array.shape[0])
+        array[:m, :m] = self.array[:m, :m]
+        self.set_array(array)
 
-        while n < self.n:
-            self.n -= 1
-            self.array.pop(-1)
-        self.modelReset.emit()
+    def remove_index(self, idx):
+        # Drops one mode's row and column, so the couplings of the others stay with their pairs
+        if idx < self.array.shape[0]:
+            self.set_array(np.delete(np.delete(self.array, idx, axis=0), idx, axis=1))
 
 
 class ConstantItem(QStandardItem):
@@ -133,18 +157,16 @@ class VarLineEdit(QLineEdit):
             self.var_root.dependent_props.discard(prop_items)
         except ValueError:
             try:
-                expr = ast.parse(text)
+                formula = Formula(text)
             except SyntaxError:
                 # TODO: Error Message Box
                 raise
             if prop_items is not None:
                 self.var_root.dependent_props.add(prop_items)
-            for item in ast.walk(expr):
-                if isinstance(item, ast.Name):
-                    var_name = item.id
-                    if var_name not in self.var_root.variables:
-                        if not self.new_variable_dialog(var_name):
-                            self.reject()
+            for var_name in formula.dependencies():
+                if var_name not in self.var_root.variables:
+                    if not self.new_variable_dialog(var_name):
+                        self.reject()
 
     def evaluate(self):
         text = str(self.text())
@@ -194,22 +216,41 @@ class FormItem(QStandardItem):
         self.val_items = {}
         self.expr_items = {}
         self.group_items = {}
+        self.kinds = {}
+        # Parsed field values, dropped whenever the field's formula or evaluated text changes
+        self.field_values = {}
         self.setup = setup
         self.params_model = QStandardItemModel()
+        self.params_model.itemChanged.connect(self.invalidate_value)
         self.params_model.itemChanged.connect(self.update_name)
         self.params_model.setHorizontalHeaderLabels(["Name", "Formula", "Evaluated"])
-        self.params_widget = QTableView()
-        self.params_widget.setModel(self.params_model)
-        self.params_widget.setItemDelegate(FormDelegate(self.params_model, self.widgets))
-        self.params_widget.verticalHeader().hide()
+        # The table view is only built once the item is first shown
+        self.form_widget = None
 
         for name, item_type, default in fields:
             self.add_field(name, item_type, default)
-        self.params_widget.resizeRowsToContents()
         self.context_menu = ActionsMenu([])
 
         self.params_model.itemChanged.connect(self.notify_group_item_children)
 
+    @property
+    def params_widget(self):
+        if self.form_widget is None:
+            self.form_widget = self.build_params_widget()
+        return self.form_widget
+
+    def build_params_widget(self):
+        table = QTableView()
+        table.setModel(self.params_model)
+        table.setItemDelegate(FormDelegate(self.params_model, self.widgets))
+        table.verticalHeader().hide()
+        table.resizeRowsToContents()
+        return table
+
+    def invalidate_value(self, item):
+        method_name = method_style(self.params_model.item(item.row(), 0).text())
+        self.field_values.pop(method_name, None)
+
     def notify_group_item_children(self, item):
         method_name = method_style(self.params_model.item(item.row(), 0).text())
         if method_name in self.group_items:
@@ -245,6 +286,10 @@ class FormItem(QStandardItem):
                 lambda grp=group, **kwargs: ItemsComboBox(grp, **kwargs)
             self.group_items[method_name] = value
             group.item_from_name(value).register_dependency(self)
+        if isinstance(item_type, GroupItem):
+            self.kinds[method_name] = ("item", str(item_type.text()))
+        else:
+            self.kinds[method_name] = self.dtypes.get(method_name, str).__name__
         self.expr_items[method_name] = QStandardItem(str(value))
         self.val_items[method_name] = ConstantItem("")
         self.params_model.appendRow([ConstantItem(word_name), self.expr_items[method_name], self.val_items[method_name]])
@@ -255,101 +300,136 @@ class FormItem(QStandardItem):
         self.params_model.item(0, 1).setText(name)
 
     def update_name(self):
+        # Renames from the tree view have already changed the text by now, so whoever indexes
+        # the item by name compares against the name it indexed
         self.setText(self.params_model.item(0, 1).text())
+        self.renamed()
+
+    def renamed(self):
+        pass
+
+    def set_value(self, method_name, value):
+        # Replaces whatever formula the field had with a plain value
+        self.setup.dependent_props.discard((self.expr_items[method_name], self.val_items[method_name]))
+        self.val_items[method_name].setText("")
+        self.expr_items[method_name].setText(str(value))
+
+    def set_formula(self, method_name, text):
+        prop_items = self.expr_items[method_name], self.val_items[method_name]
+        self.expr_items[method_name].setText(text)
+        self.setup.dependent_props.add(prop_items)
+        self.val_items[method_name].setText(str(self.setup.evaluate_formula(text)))
+
+    def field_texts(self):
+        return [(name, str(self.expr_items[name].text())) for name in self.method_names]
+
+    def load_fields(self, fields):
+        for method_name, text in fields:
+            if method_name == "name":
+                self.set_name(text)
+            elif method_name in self.group_items:
+                # itemChanged moves the dependency registration over to the named item
+                self.expr_items[method_name].setText(text)
+            else:
+                try:
+                    self.dtypes[method_name](text)
+                    self.set_value(method_name, text)
+                except ValueError:
+                    self.set_formula(method_name, text)
+
+    def save_state(self):
+        # Field kinds let the headless model evaluate the texts without the widgets
+        return {"fields": self.field_texts(), "kinds": dict(self.kinds)}
+
+    def load_state(self, state):
+        self.load_fields(state["fields"])
 
     def eval_item(self, item):
+        if item in self.field_values:
+            return self.field_values[item]
         if item in self.method_names:
             dtype = self.dtypes[item]
             text = self.val_items[item].text()
             if text == "":
                 text = self.expr_items[item].text()
-            return dtype(text)
+            value = self.field_values[item] = dtype(text)
+            return value
         else:
             raise AttributeError(item)
 
+    def field_snapshot(self):
+        values = {}
+        for name in self.method_names:
+            value = self.eval_item(name)
+            values[name] = value.name() if name in self.group_items and value is not None else value
+        return FieldValues(values)
+
     def __getattr__(self, item):
         return self.eval_item(item)
 
 
-class Formula(object):
-    def __init__(self, text):
-        self.text = text
-
-    def dependencies(self):
-        return set([s.id for s in ast.walk(ast.parse(self.text)) if isinstance(s, ast.Name)])
-
-    def evaluate(self, context):
-        return eval(self.text, context)
-
-
-def check_contexts(c1, c2):
-    for key, val in c2.items():
-        if c1.get(key, val) != val:
-            raise ValueError("Context clash %s %s %s" % (key, c1[key], c2[key]))
-
-
-class VarDAG(object):
-    def __init__(self, name, formula, vars, stack=None):
-        self.name = name
-        if not isinstance(formula, Formula):
-            formula = Formula(formula)
-        self.formula = formula
-
-        if stack is None:
-            stack = []
-        deps = formula.dependencies()
-        if any(d in stack for d in deps):
-            raise ValueError("Cycle Detected")
-        self.children = [VarDAG(dep, vars[dep].formula, vars, stack+[dep]) for dep in deps]
-
-    def generate_context(self):
-        context = {}
-        for c in self.children:
-            child_context = c.generate_context()
-            check_contexts(context, child_context)
-            context.update(child_context)
-        context[self.name] = self.formula.evaluate(context)
-        return context
-
-    def evaluate(self):
-        return self.generate_context()[self.name]
-
-    def depth(self):
-        if not self.children:
-            return 0
-        else:
-            return 1 + max(c.depth for c in self.children)
-
-
 class VarRootItem(FormItem):
     def __init__(self, name):
         super(VarRootItem, self).__init__(name, [], self)
-        self.variables = {}
+        self.variables = VarGraph()
         self.dependent_props = set()
         self.params_model.itemChanged.connect(self.variable_changed)
 
     def add_variable(self, name, type, value):
-        self.variables[name] = VarDAG(name, str(value), self.variables)
+        self.variables.set_formula(name, str(value))
         self.add_field(name, type, value)
 
-    def variable_changed(self, idx):
-        name = method_style(self.params_model.item(idx.row(), 0).text())
-        formula = str(self.params_model.item(idx.row(), 1).text())
-        self.variables[name] = VarDAG(name, formula, self.variables)
+    def variable_changed(self, item):
+        name = method_style(self.params_model.item(item.row(), 0).text())
+        if item.column() != 1 or name not in self.variables:
+            return
+        formula = str(item.text())
+        changed = self.variables.set_formula(name, formula)
 
-        # First force evaluation all variables
-        # TODO: caching
-        for var, dag in self.variables.items():
-            self.val_items[var].setText(str(dag.evaluate()))
+        for var in changed:
+            self.val_items[var].setText(str(self.variables.value(var)))
 
-        # Next reevaluate all parameterized properties
+        # Only parameterized properties reading a changed variable need re-evaluating
         for expr_item, eval_item in self.dependent_props:
-            formula = str(expr_item.text())
-            val = self.evaluate_formula(formula)
-            eval_item.setText(str(val))
+            formula = Formula(str(expr_item.text()))
+            if formula.dependencies() & changed:
+                eval_item.setText(str(self.variables.evaluate(formula)))
 
     def evaluate_formula(self, formula):
-        return VarDAG("__formula__", formula, self.variables).evaluate()
+        return self.variables.evaluate(formula)
+
+    def save_state(self):
+        # Variables in topological order, so each formula's dependencies exist when it is loaded
+        variables = [(name, self.dtypes[name], self.variables.formulas[name].text) for name in self.variables.names()]
+        fields = [(name, text) for name, text in self.field_texts() if name not in self.variables]
+        return {"fields": fields, "variables": variables}
+
+    def load_state(self, state):
+        for name, dtype, formula in state["variables"]:
+            self.add_variable(name, dtype, formula)
+        super(VarRootItem, self).load_state(state)
+        self.refresh_values()
+
+    def evaluate_sweep(self, name, values):
+        var_values = self.variables.evaluate_grid({name: values})
+        prop_values = {}
+        for expr_item, eval_item in self.dependent_props:
+            prop_values[eval_item] = self.variables.evaluate(str(expr_item.text()), var_values)
+        return var_values, prop_values
+
+    def apply_sweep_point(self, var_values, prop_values, i):
+        # Shows one point of a vectorized sweep in the evaluated column without re-evaluating anything
+        point_value = lambda v: np.asarray(v)[i].item() if np.ndim(v) else v
+        for var, vals in var_values.items():
+            self.val_items[var].setText(str(point_value(vals)))
+        for eval_item, vals in prop_values.items():
+            eval_item.setText(str(point_value(vals)))
+
+    def refresh_values(self):
+        for var in self.variables.names():
+            self.val_items[var].setText(str(self.variables.value(var)))
+        for expr_item, eval_item in self.dependent_props:
+            eval_item.setText(str(self.evaluate_formula(str(expr_item.text()))))
 
 
 class FormDelegate(QStyledItemDelegate):
@@ -433,6 +513,7 @@ def increment_name(name):
 class GroupItemEmitter(QObject):
     item_added = pyqtSignal(QStandardItem)
     item_created = pyqtSignal(QStandardItem)
+    item_removed = pyqtSignal(int)
 
 
 class GroupItem(ConstantItem):
@@ -442,39 +523,72 @@ class GroupItem(ConstantItem):
         self.context_menu = ActionsMenu([('Add ' + name, lambda c=cls: self.add_item(c)) for name, cls in child_classes])
         self.emitter = GroupItemEmitter()
         self.setup = setup
+        # Children in row order, with name and row indexes kept in step on add, remove and rename.
+        # item_names holds the name each child is indexed under
         self.current_items = []
+        self.items_by_name = {}
+        self.item_names = {}
+        self.item_rows = {}
 
     def add_item(self, cls=None, dialog=True):
         if cls is None:
             cls = self.child_classes[0][1]
         child = cls(self)
-        child_texts = [self.child(n).text() for n in range(self.rowCount())]
         self.emitter.item_created.emit(child)
-        while child.text() in child_texts:
-            child.set_name(increment_name(str(child.text())))
-        if dialog and hasattr(child, 'params_widget'):
+        while child.name() in self.items_by_name:
+            child.set_name(increment_name(child.name()))
+        if dialog:
             d = OKCancelDialog(child.params_widget)
             if not d.exec_():
                 return None
             else:
                 child.params_widget.setParent(None)
+        self.item_rows[child] = len(self.current_items)
+        self.items_by_name[child.name()] = child
+        self.item_names[child] = child.name()
         self.current_items.append(child)
         self.appendRow(child)
         self.emitter.item_added.emit(child)
         return child
 
     def remove_item(self, item):
-        idx = self.current_items.index(item)
+        idx = self.item_rows.pop(item)
         self.current_items.pop(idx)
+        name = self.item_names.pop(item)
+        if self.items_by_name.get(name) is item:
+            del self.items_by_name[name]
+        for row in range(idx, len(self.current_items)):
+            self.item_rows[self.current_items[row]] = row
         self.removeRow(idx)
+        self.emitter.item_removed.emit(idx)
+
+    def item_renamed(self, item):
+        old_name = self.item_names.get(item)
+        if old_name is None or old_name == item.name():
+            return
+        if self.items_by_name.get(old_name) is item:
+            del self.items_by_name[old_name]
+        self.items_by_name[item.name()] = item
+        self.item_names[item] = item.name()
 
     def items_list(self):
-        return [self.child(i) for i in range(self.rowCount())]
+        return list(self.current_items)
+
+    def item_index(self, item):
+        return self.item_rows[item]
 
     def item_from_name(self, name):
-        for i in self.items_list():
-            if str(i.text()) == name:
-                return i
+        return self.items_by_name.get(str(name))
+
+    def save_state(self):
+        class_names = dict((cls, name) for name, cls in self.child_classes)
+        return [(class_names[type(child)], child.save_state()) for child in self.items_list()]
+
+    def load_state(self, state):
+        classes = dict(self.child_classes)
+        for class_name, child_state in state:
+            child = self.add_item(classes[class_name], dialog=False)
+            child.load_state(child_state)
 
 class GroupItemChild(FormItem):
     def __init__(self, name, fields, group):
@@ -491,9 +605,13 @@ class GroupItemChild(FormItem):
             dependents_str = ",".join([i.name() for i in self.dependents])
             error_message("Cannot delete %s:\n%s depends on it" % (self.name(), dependents_str))
             return
-        self.params_widget.setParent(None)
+        if self.form_widget is not None:
+            self.form_widget.setParent(None)
         self.group.remove_item(self)
 
+    def renamed(self):
+        self.group.item_renamed(self)
+
     def register_dependency(self, other):
         if other not in self.dependents:
             self.dependents.append(other)
@@ -523,32 +641,44 @@ class ContextMenuStandardTreeView(QTreeView):
 
 
 class ResizableImage(QLabel):
-    def __init__(self, filename, height, min_scale, max_scale):
+    def __init__(self, filename, height, min_scale, max_scale, cache=None):
         super(ResizableImage, self).__init__()
         self.setAlignment(Qt.AlignCenter)
-        self.full_pixmap = None
+        self.cache = PixmapCache() if cache is None else cache
+        self.filename = None
         self.scaled_pixmap = None
         self.aspect = None
+        self.preload_files = []
+        self.preload_timer = QTimer()
+        self.preload_timer.setSingleShot(True)
+        self.preload_timer.timeout.connect(lambda: self.preload(self.preload_files))
         self.set_file(filename)
         self.set_height(height)
-        self.min_height = self.full_pixmap.height() * min_scale * self.aspect
-        self.min_width = self.full_pixmap.width() * min_scale / self.aspect
-        self.max_height = self.full_pixmap.height() * max_scale * self.aspect
-        self.max_width = self.full_pixmap.width() * max_scale / self.aspect
+        full_size = self.cache.size(filename)
+        self.min_height = full_size.height() * min_scale * self.aspect
+        self.min_width = full_size.width() * min_scale / self.aspect
+        self.max_height = full_size.height() * max_scale * self.aspect
+        self.max_width = full_size.width() * max_scale / self.aspect
 
     def set_file(self, filename):
-        self.full_pixmap = QPixmap(filename)
-        self.aspect = float(self.full_pixmap.height()) / self.full_pixmap.width()
+        self.filename = filename
+        full_size = self.cache.size(filename)
+        self.aspect = float(full_size.height()) / full_size.width()
         if self.scaled_pixmap is not None:
             self.set_height(self.scaled_pixmap.height())
 
+    def preload(self, filenames):
+        # Scales the images likely to be shown next to the current height in the background
+        self.preload_files = list(filenames)
+        if self.scaled_pixmap is not None:
+            self.cache.preload(self.preload_files, self.scaled_pixmap.height())
+
     def set_height(self, height):
-        self.scaled_pixmap = self.full_pixmap.scaledToHeight(height, Qt.SmoothTransformation)
+        self.scaled_pixmap = self.cache.pixmap(self.filename, height)
         self.setPixmap(self.scaled_pixmap)
 
     def set_width(self, width):
-        self.scaled_pixmap = self.full_pixmap.scaledToWidth(width, Qt.SmoothTransformation)
-        self.setPixmap(self.scaled_pixmap)
+        self.set_height(width * self.aspect)
 
     def resizeEvent(self, ev):
         width, height = ev.size().width(), ev.size().height()
@@ -557,3 +687,5 @@ class ResizableImage(QLabel):
             self.set_width(min(max(.9 * width, self.min_width), self.max_width))
         else:
             self.set_height(min(max(.9 * height, self.min_height), self.max_height))
+        # Dragging a splitter resizes many times; preload once it settles
+        self.preload_timer.start(200)
@@ -0,0 +1,17 @@
+import importlib
+
+
+class LazyModule(object):
+    # Stands in for a heavy module (qutip, scipy, pyqtgraph) until one of its attributes is first used,
+    # so the GUI can come up before the numerical stack has been imported
+    def __init__(self, name):
+        self.module_name = name
+        self.module = None
+
+    def load(self):
+        if self.module is None:
+            self.module = importlib.import_module(self.module_name)
+        return self.module
+
+    def __getattr__(self, item):
+        return getattr(self.load(), item)
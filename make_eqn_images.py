@@ -1,10 +1,52 @@
+import argparse
+import hashlib
+import json
 import os
+import shutil
 import subprocess
+import sys
 import tempfile
+from distutils.spawn import find_executable
+from multiprocessing import Pool
 
+# Renders the equation shown in the Equation dock, once plain (eqn.png) and once per symbol with that
+# symbol and the terms containing it highlighted (eqn_<symbol>.png). Each image is keyed by a hash of
+# its LaTeX source, so only variants whose source changed are rendered again, in parallel.
 
-def save_latex(filename, contents):
-    tex = r"""
+latex_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "latex")
+manifest_name = "hashes.json"
+density = 480
+
+symbols = {
+    "freq": r"\omega_j",
+    "kerr": "K_{jk}",
+    "pulse": r"\mathcal{E}(t)",
+    "drive_amp": r"\lambda_j",
+    "drive_phase": r"\theta_j",
+    "decay": r"\kappa_j",
+    "dephasing": r"\gamma_j",
+    "leg_count": "m_j",
+    "leg_phase": r"\phi_{jk}",
+    "init_state": r"|n_j\rangle",
+    "displacement": r"\alpha_i",
+}
+
+# One entry per displayed line: (template with a %s per term, [(term, symbols in the term)])
+lines = [
+    (r"\mathcal{H} = %s + %s + %s",
+     [(r"\sum_j %(freq)s a_j^\dagger a_j", ["freq"]),
+      (r"\sum_{j,k} %(kerr)sa_j^\dagger a_k^\dagger a_k a_j", ["kerr"]),
+      (r"%(pulse)s\sum_j %(drive_amp)s(e^{-i%(drive_phase)s}a_j + e^{i%(drive_phase)s}a_j^\dagger)",
+       ["pulse", "drive_amp", "drive_phase"])]),
+    (r"\dot{\rho} = \left[\mathcal{H}, \rho\right] + %s + %s \quad \psi_0 = %s\;\;\; \beta_{jk} = %s",
+     [(r"\sum_j%(decay)s\mathcal{D}\left[a_j\right]", ["decay"]),
+      (r"\sum_j%(dephasing)s\mathcal{D}\left[a_j^\dagger a_j\right]", ["dephasing"]),
+      (r"\bigotimes_j \sum_k^{%(leg_count)s} e^{i%(leg_phase)s} D_{\beta_{jk}}%(init_state)s",
+       ["leg_count", "leg_phase", "init_state"]),
+      (r"e^{2\pi i \frac{k}{%(leg_count)s}} %(displacement)s", ["leg_count", "displacement"])]),
+]
+
+document_tmpl = r"""
 \documentclass[fleqn]{article}
 \usepackage{amsmath}
 \usepackage{color}
@@ -13,146 +55,144 @@ def save_latex(filename, contents):
 \renewcommand \PreviewBbAdjust {0.0bp -\PreviewBorder 70.0bp 8.0bp}
 \usepackage[customcolors]{hf-tikz}
 \begin{document}
+\hfsetfillcolor{blue!10}
+\hfsetbordercolor{blue}
+\begin{gather*}
 %s
+\end{gather*}
 \end{document}
-""" % contents
-    print tex
-    cwd = os.getcwd()
-    #os.chdir(r"C:\Users\rsl\AppData\Local\Temp")
-    if os.path.exists(filename):
-        os.remove(filename)
-    f = tempfile.NamedTemporaryFile(delete=False, suffix=".tex")
-    f.write(tex)
-    f.close()
-    tempdir = os.path.dirname(f.name)
+"""
+
+
+def equation_latex(highlight=None, symbol_table=None):
+    table = dict(symbols)
+    if symbol_table is not None:
+        table.update(symbol_table)
+    if highlight is not None:
+        table[highlight] = r"{\color{red}\bm{%s}}" % table[highlight]
+    rendered = []
+    mark = 0
+    for line_tmpl, terms in lines:
+        formatted = []
+        for term, term_symbols in terms:
+            if highlight in term_symbols:
+                term = r"\tikzmarkin{%d}(0.1,-0.5)(-0.2,0.6)%s\tikzmarkend{%d}" % (mark, term, mark)
+                mark += 1
+            formatted.append(term % table)
+        rendered.append(line_tmpl % tuple(formatted))
+    return document_tmpl % " \\\\\n".join(rendered)
+
+
+def image_name(highlight=None, symbol_table=None):
+    name = "eqn" if highlight is None else "eqn_" + highlight
+    if symbol_table:
+        # Custom symbols get their own file next to the stock images
+        name += "_" + source_hash(repr(sorted(symbol_table.items())))[:10]
+    return name + ".png"
+
+
+def source_hash(tex):
+    return hashlib.sha1(("%d\n%s" % (density, tex)).encode("utf-8")).hexdigest()
+
+
+def converter():
+    # pdftoppm (poppler) is the fastest; ImageMagick's convert works wherever ghostscript is installed
+    if find_executable("pdftoppm"):
+        return lambda pdf, png: ["pdftoppm", "-png", "-singlefile", "-r", str(density), pdf, png[:-len(".png")]]
+    if find_executable("convert"):
+        return lambda pdf, png: ["convert", "-density", str(density), pdf, png]
+    raise RuntimeError("Rendering equations needs pdftoppm or ImageMagick's convert")
+
+
+def render_png(job):
+    tex, png_path = job
+    workdir = tempfile.mkdtemp(prefix="qutip_explorer_eqn_")
     try:
-        subprocess.check_call([
-            "latex", "-interaction=nonstopmode",
-            "-output-directory="+tempdir, f.name
-        ])
-        subprocess.check_call([
-            "pdflatex", "-interaction=nonstopmode",
-            "-output-directory="+tempdir, f.name
-        ])
+        tex_path = os.path.join(workdir, "eqn.tex")
+        pdf_path = os.path.join(workdir, "eqn.pdf")
+        png_tmp = os.path.join(workdir, "eqn.png")
+        with open(tex_path, "w") as f:
+            f.write(tex)
+        with open(os.devnull, "w") as devnull:
+            subprocess.check_call(["pdflatex", "-interaction=nonstopmode", "-halt-on-error",
+                                   "-output-directory", workdir, tex_path], stdout=devnull, stderr=devnull)
+            subprocess.check_call(converter()(pdf_path, png_tmp), stdout=devnull, stderr=devnull)
+        # Moved into place whole, so the GUI never loads a half-written image
+        if os.path.exists(png_path):
+            os.remove(png_path)
+        shutil.move(png_tmp, png_path)
     finally:
-        os.remove(f.name)
-    pdfname = f.name.replace("tex", "pdf")
-    pngname = f.name.replace("tex", "png")
+        shutil.rmtree(workdir, ignore_errors=True)
+    return png_path
 
+
+def load_manifest(directory):
     try:
-        #cmd = r"dvipng -picky -noghostscript -bg Transparent -D 480 -v " + dviname
-        #cmd = r"dvipng -picky -bg Transparent -D 480 -v " + dviname
-        def cygwinify(path):
-            return ("/cygdrive/%s%s" % tuple(path.split(":"))).lower().replace('\\','/')
-
-        #cmd = r'C:\cygwin64\bin\bash.exe -c "/usr/bin/convert -density 480 %s %s"' % (cygwinify(pdfname), cygwinify(pngname))
-        cmd = [r'C:\cygwin64\bin\bash.exe',  '-lc', 'convert -density 480 %s %s' % (cygwinify(pdfname), cygwinify(pngname))]
-        print subprocess.list2cmdline(cmd)
-        subprocess.check_call(cmd, shell=True)
-        #print cmd
-        #import shlex
-        #print shlex.split(cmd, posix=False)
-        #print subprocess.list2cmdline(shlex.split(cmd, posix=False))
-        #subprocess.check_call(shlex.split(cmd, posix=False), shell=True)
-    finally:
-        os.remove(pdfname)
-    print pngname, filename
-    os.rename(pngname, filename)
-    os.chdir(cwd)
-
-
-
-def make_images():
-    params = {
-        "leg_count": "m_j",
-        "init_state": r"|n_j\rangle",
-        "leg_phase": r"\phi_{jk}",
-        "displacement": r"\alpha_i",
-        "pulse": r"\mathcal{E}(t)",
-    }
-    components = (
-    )
-
-    eqns = {
-        "hamiltonian":
-            (r"\mathcal{H} = %s + %s + %s",
-             {"freq": r"\omega_j",
-              "kerr": "K_{jk}",
-              "drive_amp": r"\lambda_j",
-              "drive_phase": r"\theta_j"},
-             ((r"\sum_j %(freq)s a_j^\dagger a_j", ["freq"]),
-              (r"\sum_{j,k} %(kerr)sa_j^\dagger a_k^\dagger a_k a_j", ["kerr"]),
-              (r"%(pulse)s\sum_j %(drive_amp)s(e^{-i%(drive_phase)s}a_j + e^{i%(drive_phase)s}a_j^\dagger)",
-               ["pulse", "drive_amp", "drive_phase"]))),
-        "pulse":
-            (r"\mathcal{E}(t) = %s + %s",
-             {
-                 "iquad": r"\mathcal{I}",
-                 "qquad": r"\mathcal{Q}",
-                 "drive_freq": r"\omega_\text{drive}",
-                 "drive_phase": r"\omega_\text{drive}",
-             },
-             (("(iquad)s\cos(%(drive_freq)s + (drive_phase)s)s t)", ["iquad", "drive_freq", "drive_phase"]),
-              ("(qquad)s\sin(%(drive_freq)s + (drive_phase)s)s t)", ["qquad", "drive_freq", "drive_phase"]))),
-        "lindblad":
-            (r"\dot{\rho} = \left[\mathcal{H}, \rho\right] + %s + %s",
-             {"decay": r"\kappa_j",
-              "dephasing": r"\gamma_j"},
-             ((r"\sum_j%(decay)s\mathcal{D}\left[a_j\right]", ["decay"]),
-              (r"\sum_j%(dephasing)s\mathcal{D}\left[a_j^\dagger a_j\right]", ["dephasing"]))),
-        "initial":
-            (r"\psi_0 = %s\;\;\; \beta_{jk} = %s",
-             ((r"\bigotimes_j \sum_k^{%(leg_count)s} e^{i%(leg_phase)s} D_{\beta_{jk}}%(init_state)s",
-               ["leg_count", "leg_phase", "init_state"]),
-                 (r"e^{2\pi i \frac{k}{%(leg_count)s}} %(displacement)s",
-                  ["leg_count", "displacement"])
-             )),
-    }
-
-    latex_tmpl = r"""
-    \hfsetfillcolor{blue!10}
-    \hfsetbordercolor{blue}
-    \begin{gather*}
-    %s
-    \end{gather*}
-    """
-
-    path = os.path.join(os.getcwd(), "latex", "eqn%s.png")
-    #save_latex(path % "", (tmpl % tuple([c for c, _ in components])) % params)
-    for eq_name in eqns:
-        eq_tmpl, params_dict, blocks = eqns[eq_name]
-        for param_name, param_str in params_dict.items():
-            params_dict_copy = params_dict.copy()
-            params_dict_copy[param_name] = r"{\color{red}\bm{%s}}"
-            formatted_blocks = []
-            for i, (block_str, block_params) in enumerate(blocks):
-                if param_name in block_params:
-                    formatted_blocks.append(
-                        r"\tikzmarkin{%d}(0.1,-0.5)(-0.2,0.6)%s\tikzmarkend{%d}" % (i, block_str, i)
-                    )
-                else:
-                    formatted_blocks.append(block_str)
-            name = "_" + eq_name + "_" + param_name
-            latex_str = (((latex_tmpl % eq_tmpl) % tuple(formatted_blocks)) % params_dict_copy)
-            save_latex(path % name, latex_str)
-
-
-    for name in params:
-        components_copy = []
-        for i, (c, name_list) in enumerate(components):
-            if name in name_list:
-                components_copy.append(
-                    r"\tikzmarkin{%d}(0.1,-0.5)(-0.2,0.6)%s\tikzmarkend{%d}" % (i, c, i)
-                )
-            else:
-                components_copy.append(c)
-
-
-        filled_tmpl = tmpl % tuple(components_copy)
-        params_copy = params.copy()
-        params_copy[name] = r"{\color{red}\bm{%s}}" % params[name]
-        print filled_tmpl % params_copy
-        save_latex(path % ("_"+name), filled_tmpl % params_copy)
+        with open(os.path.join(directory, manifest_name)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_manifest(directory, manifest):
+    with open(os.path.join(directory, manifest_name), "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def variants(highlights=None, symbol_table=None):
+    if highlights is None:
+        highlights = [None] + sorted(symbols)
+    return [(image_name(h, symbol_table), equation_latex(h, symbol_table)) for h in highlights]
+
+
+def render_equations(highlights=None, symbol_table=None, directory=latex_dir, processes=None, force=False):
+    # Returns the paths that had to be rendered; everything else was already up to date
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    manifest = load_manifest(directory)
+    jobs = []
+    for name, tex in variants(highlights, symbol_table):
+        path = os.path.join(directory, name)
+        if force or manifest.get(name) != source_hash(tex) or not os.path.exists(path):
+            jobs.append((name, tex, path))
+    if not jobs:
+        return []
+    if processes is None or processes > 1 and len(jobs) > 1:
+        pool = Pool(processes)
+        try:
+            paths = pool.map(render_png, [(tex, path) for _, tex, path in jobs])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        paths = [render_png((tex, path)) for _, tex, path in jobs]
+    # Re-read in case another process rendered variants in the meantime
+    manifest = load_manifest(directory)
+    manifest.update((name, source_hash(tex)) for name, tex, _ in jobs)
+    save_manifest(directory, manifest)
+    return paths
+
+
+def equation_image(highlight=None, symbol_table=None, directory=latex_dir):
+    # Path of one variant, rendered on demand if it is missing or stale
+    render_equations([highlight], symbol_table, directory, processes=1)
+    return os.path.join(directory, image_name(highlight, symbol_table))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render the equation images in latex/")
+    parser.add_argument("symbols", nargs="*", help="only these highlight variants (default: all, and plain)")
+    parser.add_argument("--force", action="store_true", help="re-render even if up to date")
+    parser.add_argument("--processes", type=int, default=None, help="parallel renders (default: all cores)")
+    parser.add_argument("--directory", default=latex_dir)
+    args = parser.parse_args(argv)
+    highlights = args.symbols or None
+    rendered = render_equations(highlights, directory=args.directory, processes=args.processes, force=args.force)
+    for path in rendered:
+        sys.stdout.write("rendered %s\n" % path)
+    if not rendered:
+        sys.stdout.write("all equation images up to date\n")
+
 
 if __name__ == '__main__':
-    make_images()
+    main()
@@ -0,0 +1,698 @@
+from collections import OrderedDict
+import numpy as np
+from numpy import pi, exp, linspace
+from result_cache import snapshot_key
+from truncation import suggest_dimension, max_truncation_iterations
+from formulas import VarGraph
+from lazy_import import LazyModule
+from timing import timed
+
+qutip = LazyModule("qutip")
+compute_engine = LazyModule("compute_engine")
+batch_wigner = LazyModule("batch_wigner")
+state_store = LazyModule("state_store")
+operators = LazyModule("operators")
+frames = LazyModule("frames")
+
+# Physics of the setup tree, shared by the Qt items in qutip_explorer and the headless items below.
+# The mixins only read fields as attributes and walk group.setup, so they run against either.
+
+
+class ModeModel(object):
+    def tensor_index(self):
+        return self.group.item_index(self)
+
+    def cached_operator(self, op_name):
+        return self.group.cached_operator([(op_name, self.tensor_index())])
+
+    def destroy(self):
+        return self.cached_operator("destroy")
+
+    def hamiltonian(self, frame_frequency=0):
+        # In a frame rotating at frame_frequency only the detuning is left on the number operator
+        f0 = self.frequency - frame_frequency
+        k = self.anharmonicity
+        return f0*self.cached_operator("num") + k*self.cached_operator("kerr")
+
+    def drive_operators(self):
+        th = pi * self.drive_angle_degrees / 180
+        amp = self.drive_amplitude
+        return amp*exp(1j*th)*self.cached_operator("create"), amp*exp(-1j*th)*self.destroy()
+
+    def drive_hamiltonian(self):
+        ad_term, a_term = self.drive_operators()
+        return ad_term + a_term
+
+    def initial_state(self):
+        alpha = self.initial_displacement
+        leg_angle = exp(2j*pi/self.leg_count)
+        init_state = qutip.basis(self.dimension, self.fock_state)
+        # leg_phases = list(m.initial_leg_phases)
+        # leg_phases += [1]*(m.initial_leg_count - len(leg_phases))
+        disp_op = lambda n: operators.local_operator("displace", self.dimension, alpha*leg_angle**n)
+        return sum(disp_op(n)*init_state for n in range(self.leg_count))
+
+    def collapse_ops(self):
+        # Zero-rate terms are left out so a setup without dissipation is evolved as kets
+        c_ops = []
+        if self.decay:
+            c_ops.append(self.decay*self.destroy())
+        if self.dephasing:
+            c_ops.append(self.dephasing*self.cached_operator("num"))
+        return c_ops
+
+
+class ModesModel(object):
+    def dims(self):
+        return [m.dimension for m in self.items_list()]
+
+    def cached_operator(self, op_idx_pairs):
+        # op_idx_pairs are (operator name, tensor index); rebuilt only when the mode dimensions change.
+        # The cache is created on first use, and dropped (set to None) when modes are added or removed
+        if self.operator_cache is None:
+            self.operator_cache = operators.OperatorCache()
+        return self.operator_cache.get(self.dims(), op_idx_pairs)
+
+
+class CrossModeModel(object):
+    def hamiltonian(self):
+        idx_1 = self.mode_1.tensor_index()
+        idx_2 = self.mode_2.tensor_index()
+        op_name = "num" if self.term_type == "Cross-Kerr" else "destroy"
+        h = self.group.setup.modes_item.cached_operator([(op_name, idx_1), (op_name, idx_2)])
+        if self.term_type == "X-X":
+            h = h + h.dag()
+        return h
+
+    def rotating_terms(self, frame_frequencies=None):
+        # Cross-Kerr commutes with the frame; a_1 a_2 picks up exp(-i (nu_1 + nu_2) t)
+        if self.term_type == "Cross-Kerr":
+            return self.hamiltonian(), []
+        idx_1 = self.mode_1.tensor_index()
+        idx_2 = self.mode_2.tensor_index()
+        h = self.group.setup.modes_item.cached_operator([("destroy", idx_1), ("destroy", idx_2)])
+        phase = "(nu_%d + nu_%d)*t" % (idx_1, idx_2)
+        return 0, [[h, "exp(-1j*%s)" % phase], [h.dag(), "exp(1j*%s)" % phase]]
+
+
+class CrossModeMatrixModel(object):
+    # A whole coupling matrix as one term, sum_{j<k} C_jk n_j n_k or sum_{j<k} C_jk (a_j a_k + h.c.).
+    # Only the strict upper triangle is used, padded or cut to the current number of modes
+    def coupling_matrix(self):
+        n = len(self.group.setup.modes_item.items_list())
+        coupling = np.zeros((n, n))
+        m = min(n, len(self.coupling))
+        coupling[:m, :m] = np.triu(np.asarray(self.coupling, dtype=float)[:m, :m], 1)
+        return coupling
+
+    def lowering_operator(self, coupling):
+        return operators.pair_lowering_operator(self.group.setup.modes_item.dims(), coupling)
+
+    def hamiltonian(self):
+        coupling = self.coupling_matrix()
+        if self.term_type == "Cross-Kerr":
+            return operators.cross_kerr_operator(self.group.setup.modes_item.dims(), coupling)
+        h = self.lowering_operator(coupling)
+        return h + h.dag()
+
+    def rotating_terms(self, frame_frequencies=None):
+        if self.term_type == "Cross-Kerr":
+            return self.hamiltonian(), []
+        # Pairs rotating at the same nu_j + nu_k share one term; with a common frame that is all of them
+        coupling = self.coupling_matrix()
+        by_frequency = OrderedDict()
+        for j, k in zip(*np.nonzero(coupling)):
+            by_frequency.setdefault(frame_frequencies[j] + frame_frequencies[k], []).append((j, k))
+        terms = []
+        for pairs in by_frequency.values():
+            part = np.zeros_like(coupling)
+            for j, k in pairs:
+                part[j, k] = coupling[j, k]
+            h = self.lowering_operator(part)
+            phase = "(nu_%d + nu_%d)*t" % pairs[0]
+            terms.extend([[h, "exp(-1j*%s)" % phase], [h.dag(), "exp(1j*%s)" % phase]])
+        return 0, terms
+
+
+class OutputModel(object):
+    def xyz_operators(self):
+        a = self.mode.destroy()
+        ad = a.dag()
+        ops = [a + ad, 1j*(a - ad), a*ad]
+        return [((axis, self.mode.tensor_index()), op) for axis, op in zip("XYZ", ops)]
+
+    def register_reductions(self, reductions):
+        if self.report_type == "Wigner":
+            reductions.add_ptrace(self.mode.tensor_index())
+        else:
+            for key, op in self.xyz_operators():
+                reductions.add_expect(key, op)
+
+    def output_data(self, timings=None):
+        # (data, errors) for the simulation's current result; data is None when the simulation
+        # did not keep what this output needs
+        errors = None
+        if self.report_type == "Wigner":
+            reduced_states = self.simulation.reduced_states(self.mode.tensor_index())
+            output_steps = reduced_states
+            frequencies = self.simulation.lab_frame_frequencies(self.mode.tensor_index())
+            if reduced_states and frequencies is not None:
+                with timed(timings, "lab frame"):
+                    reduced_states = frames.to_lab_frame(reduced_states, self.simulation.times, frequencies)
+            if reduced_states:
+                dx = self.wigner_range
+                nx = self.wigner_resolution
+                axis = linspace(-dx, dx, nx)
+                frame_store = state_store.FrameStore((nx, nx))
+                with timed(timings, "wigner"):
+                    output_steps = batch_wigner.wigner_stack(reduced_states, axis, processes=self.wigner_processes,
+                                                             out=frame_store)
+        else:
+            with timed(timings, "expect"):
+                output_steps = [self.simulation.expect_values(key, op) for key, op in self.xyz_operators()]
+            errors = [self.simulation.expect_errors(key) for key, op in self.xyz_operators()]
+            frequencies = self.simulation.lab_frame_frequencies(self.mode.tensor_index())
+            if any(values is None for values in output_steps):
+                output_steps = None
+            else:
+                if frequencies is not None:
+                    x, y, z = output_steps
+                    x, y = frames.lab_frame_quadratures(x, y, self.simulation.times, frequencies[0])
+                    output_steps = [x, y, z]
+                    if not any(e is None for e in errors):
+                        # The frame rotation mixes X and Y, so bound both by the combined error
+                        xy_error = np.hypot(errors[0], errors[1])
+                        errors = [xy_error, xy_error, errors[2]]
+                output_steps = np.array(output_steps).transpose()
+            errors = None if any(e is None for e in errors) else np.array(errors).transpose()
+        return output_steps, errors
+
+
+class PulseModel(object):
+    def mesolve_args(self):
+        return {
+            'amp': self.amplitude,
+            'omega': self.frequency,
+            'phase': self.phase,
+            't0': self.duration/2.,
+            'sigma': self.sigma,
+        }
+
+    def envelope(self):
+        env_str = "amp"
+        if self.profile == "Gaussian":
+            env_str += "*exp((t-t0)**2/sigma**2)"
+        return env_str
+
+    def time_dependence(self):
+        td_str = "amp*cos(omega * t + phase)"
+        if self.profile == "Gaussian":
+            td_str += "*exp((t-t0)**2/sigma**2)"
+        return td_str
+
+    def hamiltonian(self, modes, frame_frequencies=None):
+        if frame_frequencies is None:
+            h = sum(m.drive_hamiltonian() for m in modes)
+            return [[h, self.time_dependence()]]
+        # Rotating wave approximation: of cos(omega t + phase) only the component co-rotating
+        # with each mode's frame survives, leaving a slow exp(-i (omega - nu) t) on a^dag
+        terms = []
+        for m in modes:
+            detuned_phase = "((omega - nu_%d)*t + phase)" % m.tensor_index()
+            ad_term, a_term = m.drive_operators()
+            terms.append([ad_term, "0.5*%s*exp(-1j*%s)" % (self.envelope(), detuned_phase)])
+            terms.append([a_term, "0.5*%s*exp(1j*%s)" % (self.envelope(), detuned_phase)])
+        return terms
+
+
+class SequenceModel(object):
+    def pulses(self):
+        pulses = []
+        for i in range(1, self.n_steps + 1):
+            try:
+                pulses.append(self.__getattr__("pulse_step_%d" % i))
+            except AttributeError:
+                pass
+        return pulses
+
+    def get_steps(self, frame_frequencies=None):
+        steps = []
+        for i in range(1, self.n_steps + 1):
+            try:
+                pulse_item = self.__getattr__("pulse_step_%d" % i)
+                steps.append(
+                    (pulse_item.hamiltonian(self.group.setup.modes_item.items_list(), frame_frequencies),
+                     pulse_item.duration,  pulse_item.mesolve_args())
+                )
+            except AttributeError as e:
+                try:
+                    wait_time = self.__getattr__("wait_step_%d" % i)
+                except AttributeError:
+                    raise e
+                steps.append((None, wait_time, {}))
+        return steps
+
+
+class SimulationModel(object):
+    # The helpers below take the field_snapshot() of the item, so one snapshot parses each field once
+    def reductions(self, fields=None):
+        fields = self if fields is None else fields
+        reductions = compute_engine.Reductions(keep_states=fields.keep_full_states != "No",
+                                states_on_disk=fields.keep_full_states == "On Disk")
+        for output in self.group.setup.outputs_item.items_list():
+            if output.simulation is self:
+                output.register_reductions(reductions)
+        if fields.adaptive_truncation == "On":
+            for m in self.group.setup.modes_item.items_list():
+                reductions.add_ptrace(m.tensor_index())
+        return reductions
+
+    def frame_frequencies(self, fields=None):
+        fields = self if fields is None else fields
+        modes = self.group.setup.modes_item.items_list()
+        pulses = self.sequence.pulses()
+        if fields.frame == "Lab":
+            return None
+        elif fields.frame == "Rotating At Drive Frequency" and pulses:
+            return [pulses[0].frequency] * len(modes)
+        else:
+            return [m.frequency for m in modes]
+
+    def monte_carlo_settings(self, fields=None):
+        fields = self if fields is None else fields
+        if fields.solver != "Monte Carlo":
+            return None
+        return compute_engine.MonteCarloSettings(fields.trajectories_per_batch, fields.max_trajectories,
+                                                 fields.target_precision)
+
+    def snapshot(self, timings=None):
+        setup = self.group.setup
+        fields = self.field_snapshot()
+        frame_frequencies = self.frame_frequencies(fields)
+        with timed(timings, "H0 assembly"):
+            if frame_frequencies is None:
+                h0, h0_args = setup.hamiltonian(), {}
+            else:
+                h0, h0_args = setup.rotating_hamiltonian(frame_frequencies)
+        with timed(timings, "initial state"):
+            init_state = setup.initial_state()
+        with timed(timings, "collapse operators"):
+            collapse_ops = setup.collapse_ops()
+        with timed(timings, "pulse terms"):
+            steps = self.sequence.get_steps(frame_frequencies)
+        return compute_engine.SimulationSnapshot(h0, init_state, collapse_ops, steps, fields.time_step,
+                                                 self.reductions(fields),
+                                                 compiled=fields.solve_sequence_as == "Single Compiled Solve",
+                                                 h0_args=h0_args, monte_carlo=self.monte_carlo_settings(fields))
+
+    def suggested_dimensions(self):
+        modes = self.group.setup.modes_item.items_list()
+        return [suggest_dimension(self.reduced_states(m.tensor_index()), self.truncation_tolerance)
+                for m in modes]
+
+    def reduce_states(self, indices, progress_fn=None):
+        # Traces every missing index in one pass over the stored states, shared by all outputs
+        missing = [index for index in indices
+                   if index not in self.result.reduced and index not in self.reduced_cache]
+        if missing and len(self.states):
+            self.reduced_cache.update(compute_engine.reduce_states(self.states, missing, self.trace_processes,
+                                                    progress_fn=progress_fn))
+
+    def reduced_states(self, index):
+        # Streamed during the solve when registered by an output, otherwise traced from full states
+        if self.result is None:
+            return None
+        if index in self.result.reduced:
+            return self.result.reduced[index]
+        self.reduce_states([index])
+        return self.reduced_cache.get(index)
+
+    def lab_frame_frequencies(self, index):
+        # Frame frequencies of the modes in index when outputs should be mapped back to the lab frame
+        if self.result_frame is None or self.outputs_in_lab_frame != "Yes":
+            return None
+        if isinstance(index, tuple):
+            return [self.result_frame[i] for i in index]
+        return [self.result_frame[index]]
+
+    def expect_values(self, key, op):
+        if self.result is None:
+            return None
+        if key in self.result.expect:
+            return self.result.expect[key]
+        if not len(self.states):
+            return None
+        return [qutip.expect(op, s) for s in self.states]
+
+    def expect_errors(self, key):
+        if self.result is None:
+            return None
+        return self.result.expect_errors.get(key)
+
+
+class SweepModel(object):
+    def sweep_values(self):
+        return linspace(self.initial_value, self.final_value, self.steps)
+
+    def expand(self):
+        # One independent snapshot per sweep point.
+        # Variables and parameterized properties are evaluated for all points in one vectorized pass
+        setup = self.group.setup
+        values = self.sweep_values()
+        var_values, prop_values = setup.evaluate_sweep(self.parameter_name, values)
+        snapshots = []
+        try:
+            for i in range(len(values)):
+                setup.apply_sweep_point(var_values, prop_values, i)
+                snapshots.append(self.simulation.snapshot())
+        finally:
+            setup.refresh_values()
+        return snapshots
+
+
+class SetupModel(object):
+    def hamiltonian(self):
+        modes = self.modes_item.items_list()
+        return sum(m.hamiltonian() for m in modes) + \
+            sum(t.hamiltonian() for t in self.cross_mode_terms_item.items_list())
+
+    def rotating_hamiltonian(self, frame_frequencies):
+        # H0 in the frame rotating at frame_frequencies[j] for mode j, and the nu_j args its terms need
+        modes = self.modes_item.items_list()
+        h0 = sum(m.hamiltonian(frame_frequencies[m.tensor_index()]) for m in modes)
+        td_terms = []
+        for t in self.cross_mode_terms_item.items_list():
+            static, terms = t.rotating_terms(frame_frequencies)
+            h0 = h0 + static
+            td_terms.extend(terms)
+        args = dict(("nu_%d" % i, nu) for i, nu in enumerate(frame_frequencies))
+        if td_terms:
+            return [h0] + td_terms, args
+        return h0, args
+
+    def initial_state(self):
+        return qutip.tensor(*[m.initial_state() for m in self.modes_item.items_list()])
+
+    def collapse_ops(self):
+        return sum([m.collapse_ops() for m in self.modes_item.items_list()], [])
+
+
+# Headless items, built from the states FormItem.save_state writes into a project file
+
+field_types = {"int": int, "float": float, "str": str, "bool": bool}
+
+
+class FieldValues(object):
+    # Read-only copy of an item's evaluated fields, for compute code and worker processes.
+    # Fields naming another item hold that item's name
+    def __init__(self, values):
+        object.__setattr__(self, "values", dict(values))
+
+    def name(self):
+        return self.values["name"]
+
+    def __getattr__(self, item):
+        values = self.__dict__.get("values", {})
+        if item not in values:
+            raise AttributeError(item)
+        return values[item]
+
+    def __setattr__(self, key, value):
+        raise AttributeError("FieldValues are read-only")
+
+    def __reduce__(self):
+        return FieldValues, (self.values,)
+
+
+class Item(object):
+    def __init__(self, group, class_name, state):
+        self.group = group
+        self.class_name = class_name
+        self.texts = OrderedDict(state["fields"])
+        self.kinds = state["kinds"]
+
+    def name(self):
+        return self.texts["name"]
+
+    def set_value(self, method_name, value):
+        self.texts[method_name] = str(value)
+
+    def save_state(self):
+        return {"fields": list(self.texts.items()), "kinds": dict(self.kinds)}
+
+    def field_snapshot(self):
+        values = {}
+        for name, kind in self.kinds.items():
+            value = self.group.setup.field_value(kind, self.texts[name])
+            values[name] = value.name() if isinstance(kind, tuple) and value is not None else value
+        return FieldValues(values)
+
+    def __getattr__(self, item):
+        texts = self.__dict__.get("texts", {})
+        if item not in texts:
+            raise AttributeError(item)
+        return self.group.setup.field_value(self.kinds[item], texts[item])
+
+
+class Group(object):
+    def __init__(self, setup, title, item_class):
+        self.setup = setup
+        self.title = title
+        self.item_class = item_class
+        self.items = []
+        self.items_by_name = {}
+        self.item_rows = {}
+        # Called with the row of each removed item, like GroupItemEmitter.item_removed
+        self.removed_callbacks = []
+
+    def items_list(self):
+        return list(self.items)
+
+    def remove_item(self, item):
+        idx = self.item_rows.pop(item)
+        self.items.pop(idx)
+        if self.items_by_name.get(item.name()) is item:
+            del self.items_by_name[item.name()]
+        for row in range(idx, len(self.items)):
+            self.item_rows[self.items[row]] = row
+        for callback in self.removed_callbacks:
+            callback(idx)
+        if hasattr(item, "removed"):
+            item.removed()
+
+    def item_index(self, item):
+        return self.item_rows[item]
+
+    def item_from_name(self, name):
+        return self.items_by_name.get(name)
+
+    def save_state(self):
+        return [(i.class_name, i.save_state()) for i in self.items]
+
+    def load_state(self, state):
+        for class_name, item_state in state:
+            item = self.item_class(self, class_name, item_state)
+            self.item_rows[item] = len(self.items)
+            self.items_by_name[item.name()] = item
+            self.items.append(item)
+
+
+class Mode(ModeModel, Item):
+    pass
+
+
+class Modes(ModesModel, Group):
+    def __init__(self, *args):
+        super(Modes, self).__init__(*args)
+        self.operator_cache = None
+
+    def remove_item(self, item):
+        self.operator_cache = None
+        super(Modes, self).remove_item(item)
+
+
+class CrossModeTerm(CrossModeModel, Item):
+    pass
+
+
+class CrossModeMatrix(CrossModeMatrixModel, Item):
+    def __init__(self, group, class_name, state):
+        super(CrossModeMatrix, self).__init__(group, class_name, state)
+        self.coupling = np.asarray(state["coupling"], dtype=float)
+        group.setup.modes_item.removed_callbacks.append(self.mode_removed)
+
+    def mode_removed(self, idx):
+        if idx < len(self.coupling):
+            self.coupling = np.delete(np.delete(self.coupling, idx, axis=0), idx, axis=1)
+
+    def removed(self):
+        self.group.setup.modes_item.removed_callbacks.remove(self.mode_removed)
+
+    def save_state(self):
+        state = super(CrossModeMatrix, self).save_state()
+        state["coupling"] = self.coupling
+        return state
+
+
+def cross_mode_item(group, class_name, state):
+    if class_name == "Cross-Mode Matrix":
+        return CrossModeMatrix(group, class_name, state)
+    return CrossModeTerm(group, class_name, state)
+
+
+class Pulse(PulseModel, Item):
+    pass
+
+
+class Sequence(SequenceModel, Item):
+    def __init__(self, *args):
+        super(Sequence, self).__init__(*args)
+        steps = [int(name.rsplit("_", 1)[1]) for name in self.texts
+                 if name.startswith("pulse_step_") or name.startswith("wait_step_")]
+        self.n_steps = max(steps) if steps else 0
+
+
+class Output(OutputModel, Item):
+    def __init__(self, group, class_name, state):
+        super(Output, self).__init__(group, class_name, state)
+        self.data = state.get("data")
+        self.errors = state.get("errors")
+
+    def save_state(self):
+        state = super(Output, self).save_state()
+        state.update(data=self.data, errors=self.errors)
+        return state
+
+    def compute(self, timings=None):
+        self.data, self.errors = self.output_data(timings)
+
+
+class Simulation(SimulationModel, Item):
+    def __init__(self, group, class_name, state):
+        super(Simulation, self).__init__(group, class_name, state)
+        self.result = state.get("result")
+        self.result_key = state.get("result_key")
+        self.result_frame = state.get("result_frame")
+        self.dirty = state.get("dirty", True)
+        self.reduced_cache = {}
+        self.times = self.states = None
+        if self.result is not None:
+            self.times = self.result.times
+            self.states = self.result.states
+
+    def save_state(self):
+        state = super(Simulation, self).save_state()
+        state.update(result=self.result, result_key=self.result_key, result_frame=self.result_frame,
+                     dirty=self.dirty)
+        return state
+
+    def run(self, cache=None, progress_fn=None, status_fn=None, timings=None):
+        # Same loop the GUI runs through its workers, with adaptive truncation re-running in place
+        for iteration in range(max_truncation_iterations + 1):
+            snapshot = self.snapshot(timings)
+            self.result_frame = self.frame_frequencies()
+            self.result = compute_engine.run_cached(snapshot, cache, progress_fn=progress_fn, status_fn=status_fn,
+                                                    timings=timings)
+            self.result_key = snapshot_key(snapshot)
+            self.reduced_cache = {}
+            self.times = self.result.times
+            self.states = self.result.states
+            self.dirty = False
+            if self.adaptive_truncation != "On":
+                return
+            modes = self.group.setup.modes_item.items_list()
+            new_dims = self.suggested_dimensions()
+            if new_dims == [m.dimension for m in modes] or iteration == max_truncation_iterations:
+                return
+            for m, dim in zip(modes, new_dims):
+                m.set_value("dimension", dim)
+
+
+class Sweep(SweepModel, Item):
+    def __init__(self, group, class_name, state):
+        super(Sweep, self).__init__(group, class_name, state)
+        self.result = state.get("result")
+
+    def save_state(self):
+        state = super(Sweep, self).save_state()
+        state["result"] = self.result
+        return state
+
+    def run(self, processes=None, cache=None, progress_fn=None):
+        self.result = compute_engine.run_sweep(self.expand(), self.sweep_values(), processes, cache,
+                                               progress_fn=progress_fn)
+
+
+class Setup(SetupModel):
+    groups = [
+        ("modes_item", "Modes", Modes, Mode),
+        ("cross_mode_terms_item", "Cross-Mode Terms", Group, cross_mode_item),
+        ("pulses_item", "Pulses", Group, Pulse),
+        ("sequences_item", "Pulse Sequences", Group, Sequence),
+        ("sims_item", "Analysis", Group, Simulation),
+        ("sweeps_item", "Sweeps", Group, Sweep),
+        ("outputs_item", "Outputs", Group, Output),
+    ]
+
+    def __init__(self, state):
+        self.setup = self
+        self.texts = OrderedDict(state["fields"])
+        self.kinds = state["kinds"]
+        self.variables = VarGraph()
+        self.var_types = []
+        self.point_values = None
+        for name, dtype, formula in state["variables"]:
+            self.variables.set_formula(name, formula)
+            self.var_types.append((name, dtype))
+        self.titles = {}
+        # Groups load in dependency order, so every item a field names already exists
+        for (name, title, group_class, item_class), group_state in zip(self.groups, state["groups"]):
+            group = group_class(self, title, item_class)
+            setattr(self, name, group)
+            self.titles[title] = group
+            group.load_state(group_state)
+
+    def name(self):
+        return self.texts["name"]
+
+    def field_value(self, kind, text):
+        if isinstance(kind, tuple):
+            return self.titles[kind[1]].item_from_name(text)
+        dtype = field_types[kind]
+        try:
+            return dtype(text)
+        except ValueError:
+            return dtype(self.evaluate_formula(text))
+
+    def evaluate_formula(self, formula):
+        return self.variables.evaluate(formula, self.point_values)
+
+    def evaluate_sweep(self, name, values):
+        # Fields are evaluated on access, so only the variables need the vectorized pass
+        return self.variables.evaluate_grid({name: values}), {}
+
+    def apply_sweep_point(self, var_values, prop_values, i):
+        point_value = lambda v: np.asarray(v)[i].item() if np.ndim(v) else v
+        self.point_values = dict((var, point_value(vals)) for var, vals in var_values.items())
+
+    def refresh_values(self):
+        self.point_values = None
+
+    def compute_outputs(self, sim, timings=None):
+        outputs = [o for o in self.outputs_item.items_list() if o.simulation is sim]
+        reductions = compute_engine.Reductions()
+        for output in outputs:
+            output.register_reductions(reductions)
+        with timed(timings, "ptrace"):
+            sim.reduce_states(reductions.ptrace_indices)
+        for output in outputs:
+            output.compute(timings)
+
+    def save_state(self):
+        variables = [(name, dtype, self.variables.formulas[name].text) for name, dtype in self.var_types]
+        return {
+            "fields": list(self.texts.items()),
+            "kinds": dict(self.kinds),
+            "variables": variables,
+            "groups": [getattr(self, name).save_state() for name, _, _, _ in self.groups],
+        }
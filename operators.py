@@ -0,0 +1,88 @@
+import numpy as np
+import scipy.sparse as sp
+from qutip import destroy, create, num, qeye, displace, tensor, Qobj
+
+local_factories = {
+    "destroy": destroy,
+    "create": create,
+    "num": num,
+    "identity": qeye,
+    "kerr": lambda dim: create(dim) * create(dim) * destroy(dim) * destroy(dim),
+    "displace": displace,
+}
+
+# Single-mode operators keyed by (name, dimension, params...)
+local_cache = {}
+max_local_cache = 1024
+
+
+def local_operator(name, dim, *params):
+    key = (name, dim) + params
+    if key not in local_cache:
+        if len(local_cache) >= max_local_cache:
+            local_cache.clear()
+        local_cache[key] = local_factories[name](dim, *params)
+    return local_cache[key]
+
+
+def operator_on_indices(dims, h_idx_pairs):
+    op_list = [local_operator("identity", d) for d in dims]
+    for h, idx in h_idx_pairs:
+        op_list[idx] = h
+    return tensor(*op_list)
+
+
+class OperatorCache(object):
+    # Tensor-embedded operators keyed by (operator name, mode index) pairs. Everything is dropped
+    # as soon as the tuple of mode dimensions differs from the one the operators were built for.
+    def __init__(self):
+        self.dims = None
+        self.operators = {}
+
+    def clear(self):
+        self.dims = None
+        self.operators = {}
+
+    def get(self, dims, op_idx_pairs):
+        dims = tuple(dims)
+        if dims != self.dims:
+            self.operators = {}
+            self.dims = dims
+        key = tuple(op_idx_pairs)
+        if key not in self.operators:
+            h_idx_pairs = [(local_operator(name, dims[idx]), idx) for name, idx in key]
+            self.operators[key] = operator_on_indices(dims, h_idx_pairs)
+        return self.operators[key]
+
+
+# Whole coupling matrices, assembled straight in the product basis rather than as one tensor product per pair
+
+def occupations(dims):
+    # Occupation number of each mode in every product basis state, shape (modes, prod(dims))
+    return np.indices(dims).reshape(len(dims), -1)
+
+
+def cross_kerr_operator(dims, coupling):
+    # sum_jk C_jk n_j n_k is diagonal
+    occ = occupations(dims)
+    diagonal = np.einsum("jn,jk,kn->n", occ, coupling, occ)
+    return Qobj(sp.diags(diagonal, 0, format="csr"), dims=[list(dims), list(dims)])
+
+
+def pair_lowering_operator(dims, coupling):
+    # sum_jk C_jk a_j a_k for j != k: each pair lowers the states where both modes are occupied
+    occ = occupations(dims)
+    strides = [int(np.prod(dims[j+1:])) for j in range(len(dims))]
+    size = int(np.prod(dims))
+    rows, cols, vals = [], [], []
+    for j, k in zip(*np.nonzero(coupling)):
+        source = np.nonzero((occ[j] > 0) & (occ[k] > 0))[0]
+        cols.append(source)
+        rows.append(source - strides[j] - strides[k])
+        vals.append(coupling[j, k] * np.sqrt(occ[j, source] * occ[k, source]))
+    if not rows:
+        data = sp.csr_matrix((size, size), dtype=complex)
+    else:
+        data = sp.coo_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                             shape=(size, size), dtype=complex).tocsr()
+    return Qobj(data, dims=[list(dims), list(dims)])
@@ -0,0 +1,81 @@
+from PyQt4.QtCore import Qt
+from PyQt4.QtGui import QWidget, QVBoxLayout, QHBoxLayout, QComboBox, QPushButton, QLabel, QTableView, \
+    QStandardItemModel, QStandardItem, QFileDialog, QHeaderView
+from interface_helpers import error_message
+
+max_runs = 20
+
+
+class PerformancePanel(QWidget):
+    # Stage timings of the most recent compute runs, one table per run, each exportable as JSON
+    def __init__(self):
+        super(PerformancePanel, self).__init__()
+        self.runs = []
+        self.run_combo = QComboBox()
+        self.run_combo.currentIndexChanged.connect(self.show_run)
+        export_button = QPushButton("Export JSON")
+        export_button.clicked.connect(self.export_run)
+        self.summary_label = QLabel("No runs yet")
+        self.stages_model = QStandardItemModel()
+        self.stages_model.setHorizontalHeaderLabels(["Stage", "Calls", "Seconds", "Max", "Share"])
+        stages_view = QTableView()
+        stages_view.setModel(self.stages_model)
+        stages_view.verticalHeader().hide()
+        stages_view.horizontalHeader().setResizeMode(0, QHeaderView.Stretch)
+
+        top_layout = QHBoxLayout()
+        top_layout.addWidget(self.run_combo, 1)
+        top_layout.addWidget(export_button)
+        layout = QVBoxLayout(self)
+        layout.addLayout(top_layout)
+        layout.addWidget(self.summary_label)
+        layout.addWidget(stages_view)
+
+    def add_run(self, timings):
+        # A run already listed (outputs recomputed, Monte Carlo batches) is refreshed in place
+        if timings in self.runs:
+            idx = self.runs.index(timings)
+        else:
+            self.runs.insert(0, timings)
+            self.run_combo.insertItem(0, "")
+            idx = 0
+            while len(self.runs) > max_runs:
+                self.runs.pop()
+                self.run_combo.removeItem(self.run_combo.count() - 1)
+        run = timings.as_dict()
+        self.run_combo.setItemText(idx, "%s  %s" % (run["started"].replace("T", " "), run["label"]))
+        if self.run_combo.currentIndex() == idx:
+            self.show_run(idx)
+        else:
+            self.run_combo.setCurrentIndex(idx)
+
+    def show_run(self, idx):
+        self.stages_model.removeRows(0, self.stages_model.rowCount())
+        if not 0 <= idx < len(self.runs):
+            self.summary_label.setText("No runs yet")
+            return
+        run = self.runs[idx].as_dict()
+        total = run["total_seconds"] or 1
+        for stage in run["stages"]:
+            row = [QStandardItem(stage["stage"]), QStandardItem(str(stage["calls"])),
+                   QStandardItem("%.3f" % stage["seconds"]), QStandardItem("%.3f" % stage["max_seconds"]),
+                   QStandardItem("%.0f%%" % (100 * stage["seconds"] / total))]
+            for item in row:
+                item.setEditable(False)
+            for item in row[1:]:
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            self.stages_model.appendRow(row)
+        self.summary_label.setText("%.3f s total, peak stored states %.1f MB"
+                                   % (run["total_seconds"], run["peak_state_bytes"] / 2.**20))
+
+    def export_run(self):
+        idx = self.run_combo.currentIndex()
+        if not 0 <= idx < len(self.runs):
+            return
+        path = str(QFileDialog.getSaveFileName(self, "Export Timings", "", "JSON (*.json)"))
+        if not path:
+            return
+        try:
+            self.runs[idx].save_json(path)
+        except (IOError, OSError) as e:
+            error_message(str(e), "Exporting timings failed")
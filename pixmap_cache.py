@@ -0,0 +1,110 @@
+from collections import OrderedDict
+from PyQt4.QtCore import QObject, QThread, Qt, pyqtSignal
+from PyQt4.QtGui import QImage, QPixmap
+
+default_max_bytes = 64 * 2**20
+
+
+def image_bytes(image):
+    return image.width() * image.height() * image.depth() // 8
+
+
+class ImageLoader(QObject):
+    # Decodes and scales images on its own thread. Only QImage may be used off the GUI thread,
+    # so results are handed back as images and turned into pixmaps by the cache
+    requested = pyqtSignal(list, int)
+    image_loaded = pyqtSignal(str, QImage)
+    image_scaled = pyqtSignal(str, int, QImage)
+
+    def __init__(self):
+        super(ImageLoader, self).__init__()
+        self.thread = QThread()
+        self.moveToThread(self.thread)
+        self.requested.connect(self.load)
+        self.thread.start()
+
+    def load(self, filenames, height):
+        for filename in filenames:
+            image = QImage(filename)
+            if image.isNull():
+                continue
+            self.image_loaded.emit(filename, image)
+            if height > 0:
+                self.image_scaled.emit(filename, height, image.scaledToHeight(height, Qt.SmoothTransformation))
+
+    def stop(self):
+        self.thread.quit()
+        self.thread.wait()
+
+
+class PixmapCache(QObject):
+    # Decoded originals and pre-scaled pixmaps keyed by (filename, height), least recently used dropped
+    # past max_bytes. Originals are kept under height 0 so a miss costs a rescale but never a disk read.
+    def __init__(self, max_bytes=default_max_bytes):
+        super(PixmapCache, self).__init__()
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+        self.pending = set()
+        self.loader = None
+
+    def insert(self, key, value):
+        if key in self.entries:
+            self.total_bytes -= image_bytes(self.entries.pop(key))
+        self.entries[key] = value
+        self.total_bytes += image_bytes(value)
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= image_bytes(evicted)
+
+    def lookup(self, key):
+        value = self.entries.pop(key, None)
+        if value is not None:
+            self.entries[key] = value
+        return value
+
+    def original(self, filename):
+        image = self.lookup((filename, 0))
+        if image is None:
+            image = QImage(filename)
+            self.insert((filename, 0), image)
+        return image
+
+    def pixmap(self, filename, height):
+        height = int(round(height))
+        pixmap = self.lookup((filename, height))
+        if pixmap is None:
+            pixmap = QPixmap.fromImage(self.original(filename).scaledToHeight(height, Qt.SmoothTransformation))
+            self.insert((filename, height), pixmap)
+        return pixmap
+
+    def size(self, filename):
+        return self.original(filename).size()
+
+    def preload(self, filenames, height=0):
+        height = int(round(height))
+        missing = [f for f in filenames if (f, height) not in self.entries and (f, height) not in self.pending]
+        if not missing:
+            return
+        if self.loader is None:
+            self.loader = ImageLoader()
+            self.loader.image_loaded.connect(self.original_loaded)
+            self.loader.image_scaled.connect(self.scaled_loaded)
+        self.pending.update((f, height) for f in missing)
+        self.loader.requested.emit(missing, height)
+
+    def original_loaded(self, filename, image):
+        filename = str(filename)
+        self.pending.discard((filename, 0))
+        if (filename, 0) not in self.entries:
+            self.insert((filename, 0), image)
+
+    def scaled_loaded(self, filename, height, image):
+        key = (str(filename), height)
+        self.pending.discard(key)
+        if key not in self.entries:
+            self.insert(key, QPixmap.fromImage(image))
+
+    def stop(self):
+        if self.loader is not None:
+            self.loader.stop()
@@ -0,0 +1,65 @@
+from numpy import array
+from pyqtgraph import ImageView, PlotWidget, ErrorBarItem, setConfigOption, mkPen
+from pyqtgraph.dockarea import DockArea, Dock
+from pyqtgraph.graphicsItems.InfiniteLine import InfiniteLine
+import itertools
+
+# Output widgets, imported on the first plot so pyqtgraph stays out of the startup path.
+# The pyqtgraph classes the GUI uses are re-exported from here, so it never imports pyqtgraph itself
+__all__ = ["MyImageView", "TimePlot", "pen_generator", "ImageView", "PlotWidget", "ErrorBarItem", "DockArea", "Dock"]
+
+setConfigOption('background', 'w')
+setConfigOption('foreground', 'k')
+pen_list = [mkPen(color, width=2) for color in 'bgrcmyk']
+pen_generator = lambda: itertools.cycle(pen_list)
+
+
+class MyImageView(ImageView):
+    def __init__(self, time_slider):
+        super(MyImageView, self).__init__()
+        self.time_slider = time_slider
+        self.ui.histogram.gradient.restoreState(
+            {"ticks": [(0.0, (255, 0, 0)), (0.5, (255, 255, 255)), (1.0, (0, 0, 255))], "mode": "rgb"}
+        )
+        self.h_line = InfiniteLine(pos=0, angle=0)
+        self.v_line = InfiniteLine(pos=0, angle=90)
+        self.view.addItem(self.h_line)
+        self.view.addItem(self.v_line)
+        self.frames = None
+        self.time_slider.valueChanged.connect(self.set_time)
+
+    def set_frames(self, frames):
+        # frames is a FrameStore; only the frame under the time slider is ever loaded
+        self.frames = frames
+        frame = array(frames[0])
+        self.setImage(frame)
+        self.v_line.setPos(frame.shape[0]/2.)
+        self.h_line.setPos(frame.shape[1]/2.)
+        max_value = frames.max_abs
+        self.setLevels(-max_value, max_value)
+        self.time_slider.setMaximum(len(frames)-1)
+
+    def set_time(self, time_idx):
+        if self.frames is not None and time_idx < len(self.frames):
+            self.setImage(array(self.frames[time_idx]), autoLevels=False, autoRange=False)
+
+
+class TimePlot(PlotWidget):
+    def __init__(self, time_slider, *args, **kwargs):
+        super(TimePlot, self).__init__(*args, **kwargs)
+        self.time_slider = time_slider
+        self.add_line()
+        self.time_slider.valueChanged.connect(self.set_time)
+
+    def add_line(self):
+        self.time_vline = InfiniteLine(angle=90)
+        self.addItem(self.time_vline)
+
+    def plot(self, x, *args, **kwargs):
+        self.time_pts = x
+        self.time_slider.setMaximum(len(self.time_pts)-1)
+        self.plotItem.plot(x, *args, **kwargs)
+
+    def set_time(self, time_idx):
+        pos = self.time_pts[time_idx]
+        self.time_vline.setPos(pos)
@@ -0,0 +1,197 @@
+import os
+import pickle
+import struct
+import tempfile
+from numpy import ndarray, memmap, asarray, empty, dtype as as_dtype
+from qutip import Qobj
+from state_store import FrameStore, StateStore
+
+# Layout: magic, raw array blocks, pickled header, 8-byte offset of the header.
+# The header holds the project tree with every large array replaced by a reference to its block,
+# so opening a project reads only the header and maps the blocks on demand.
+magic = b"QXPROJ01"
+alignment = 64
+min_block_bytes = 1 << 14
+
+
+class ArrayBlock(object):
+    def __init__(self, offset, dtype, shape):
+        self.offset = offset
+        self.dtype = dtype
+        self.shape = shape
+
+
+class StatesBlock(object):
+    def __init__(self, block, dims):
+        self.block = block
+        self.dims = dims
+
+
+class FramesBlock(object):
+    def __init__(self, block, max_abs):
+        self.block = block
+        self.max_abs = max_abs
+
+
+class ObjectArray(object):
+    def __init__(self, shape, items):
+        self.shape = shape
+        self.items = items
+
+
+class StoredObject(object):
+    def __init__(self, cls, state):
+        self.cls = cls
+        self.state = state
+
+
+class LazyFrames(object):
+    # Read-only view of frames in a project file, shaped like a FrameStore
+    def __init__(self, frames, max_abs):
+        self.frames = frames
+        self.max_abs = max_abs
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, n):
+        return self.frames[n]
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def array(self):
+        return asarray(self.frames)
+
+
+class LazyStates(LazyFrames):
+    # States in a project file, handed back as Qobj on access like a StateStore
+    def __init__(self, frames, dims):
+        super(LazyStates, self).__init__(frames, None)
+        self.dims = dims
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(len(self.frames)))]
+        return Qobj(self.frames[n], dims=self.dims)
+
+    def __iter__(self):
+        for n in range(len(self.frames)):
+            yield self[n]
+
+
+def is_state_list(value):
+    if not isinstance(value, (list, LazyStates)) or not len(value):
+        return False
+    if isinstance(value, LazyStates):
+        return True
+    dims = value[0].dims if isinstance(value[0], Qobj) else None
+    return dims is not None and all(isinstance(s, Qobj) and s.dims == dims for s in value)
+
+
+class ProjectWriter(object):
+    def __init__(self, f):
+        self.f = f
+
+    def write_frames(self, frames, frame_shape, dtype):
+        # Frames are streamed one at a time, so stores larger than memory can be saved
+        pad = -self.f.tell() % alignment
+        self.f.write(b"\0" * pad)
+        offset = self.f.tell()
+        n = 0
+        for frame in frames:
+            self.f.write(asarray(frame, dtype=dtype).tobytes())
+            n += 1
+        return ArrayBlock(offset, as_dtype(dtype).str, (n,) + tuple(frame_shape))
+
+    def encode(self, value):
+        if isinstance(value, (StateStore, LazyStates)) or is_state_list(value):
+            first = value[0]
+            frames = (s.full() for s in value)
+            return StatesBlock(self.write_frames(frames, first.shape, complex), first.dims)
+        if isinstance(value, (FrameStore, LazyFrames)):
+            if not len(value):
+                return FramesBlock(None, value.max_abs)
+            shape = asarray(value[0]).shape
+            return FramesBlock(self.write_frames(value, shape, asarray(value[0]).dtype), value.max_abs)
+        if isinstance(value, ndarray):
+            if value.dtype == object:
+                return ObjectArray(value.shape, self.encode(list(value.ravel())))
+            if value.nbytes < min_block_bytes:
+                return value
+            return self.write_frames(value, value.shape[1:], value.dtype)
+        if isinstance(value, dict):
+            return dict((k, self.encode(v)) for k, v in value.items())
+        if isinstance(value, list):
+            return [self.encode(v) for v in value]
+        if isinstance(value, tuple):
+            return tuple(self.encode(v) for v in value)
+        if hasattr(value, "__dict__") and not isinstance(value, (Qobj, type)):
+            return StoredObject(type(value), self.encode(value.__dict__))
+        return value
+
+
+class ProjectReader(object):
+    def __init__(self, path):
+        self.path = path
+
+    def block(self, block):
+        if block.shape[0] == 0:
+            return empty(block.shape, dtype=block.dtype)
+        return memmap(self.path, dtype=block.dtype, mode="r", offset=block.offset, shape=block.shape)
+
+    def decode(self, value):
+        if isinstance(value, ArrayBlock):
+            return self.block(value)
+        if isinstance(value, StatesBlock):
+            return LazyStates(self.block(value.block), value.dims)
+        if isinstance(value, FramesBlock):
+            frames = [] if value.block is None else self.block(value.block)
+            return LazyFrames(frames, value.max_abs)
+        if isinstance(value, ObjectArray):
+            items = self.decode(value.items)
+            array = empty(len(items), dtype=object)
+            for i, item in enumerate(items):
+                array[i] = item
+            return array.reshape(value.shape)
+        if isinstance(value, StoredObject):
+            obj = value.cls.__new__(value.cls)
+            obj.__dict__.update(self.decode(value.state))
+            return obj
+        if isinstance(value, dict):
+            return dict((k, self.decode(v)) for k, v in value.items())
+        if isinstance(value, list):
+            return [self.decode(v) for v in value]
+        if isinstance(value, tuple):
+            return tuple(self.decode(v) for v in value)
+        return value
+
+
+def save_project(path, document):
+    # Written beside the target and renamed over it, since the old file may still be mapped by lazy arrays
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(magic)
+            header = ProjectWriter(f).encode(document)
+            header_offset = f.tell()
+            pickle.dump(header, f, 2)
+            f.write(struct.pack("<Q", header_offset))
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_name, path)
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+
+
+def load_project(path):
+    with open(path, "rb") as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError("%s is not a project file" % path)
+        f.seek(-8, os.SEEK_END)
+        header_offset, = struct.unpack("<Q", f.read(8))
+        f.seek(header_offset)
+        header = pickle.load(f)
+    return ProjectReader(path).decode(header)
@@ -1,28 +1,38 @@
+import time
+startup_time = time.time()
+import glob
+import os
+import sys
 from PyQt4.QtCore import QSettings, QTimer
-from PyQt4.QtGui import QApplication, QMainWindow, QProgressBar, QGroupBox, QRadioButton, QDockWidget, QWidget, \
-    QHBoxLayout, QPushButton, QMessageBox, QIcon, QSlider
-import itertools
-from numpy import linspace
-from pyqtgraph import ImageView, PlotWidget, setConfigOption, mkPen
-from pyqtgraph.dockarea import DockArea, Dock
-from pyqtgraph.graphicsItems.InfiniteLine import InfiniteLine
-from qutip import *
+from PyQt4.QtGui import QApplication, QMainWindow, QProgressBar, QDockWidget, QWidget, \
+    QHBoxLayout, QPushButton, QMessageBox, QIcon, QSlider, QFileDialog
 from interface_helpers import *
+from result_cache import ResultCache, snapshot_key
+from truncation import max_truncation_iterations
+from lazy_import import LazyModule
+from timing import RunTimings, timed
+from performance_panel import PerformancePanel
+from model import ModeModel, ModesModel, CrossModeModel, CrossModeMatrixModel, OutputModel, PulseModel, SequenceModel, \
+    SimulationModel, SweepModel, SetupModel
+
+# Imported on first use, so the window comes up before qutip and pyqtgraph have loaded
+qutip = LazyModule("qutip")
+compute_engine = LazyModule("compute_engine")
+compute_worker = LazyModule("compute_worker")
+project_file = LazyModule("project_file")
+plots = LazyModule("plots")
 
 __author__ = "Phil Reinhold"
 __version__ = 0.1
 __ui_version__ = 1
-setConfigOption('background', 'w')
-setConfigOption('foreground', 'k')
-pen_list = [mkPen(color, width=2) for color in 'bgrcmyk']
-pen_generator = lambda: itertools.cycle(pen_list)
+project_filter = "QuTiP Explorer Projects (*.qxp)"
 
 class ModeItemEmitter(QObject):
     mode_form_focus_in = pyqtSignal(str)
     mode_form_focus_out = pyqtSignal(str)
 
 
-class ModeItem(GroupItemChild):
+class ModeItem(ModeModel, GroupItemChild):
     def __init__(self, group):
         super(ModeItem, self).__init__("Mode_1", [
             ("dimension", int, 2),
@@ -38,6 +48,8 @@ class ModeItem(GroupItemChild):
         ], group)
         # TODO: Initial-leg-phases
 
+    def build_params_widget(self):
+        table = super(ModeItem, self).build_params_widget()
         eqn_associations = {
             "Frequency": "freq",
             "Anharmonicity": "kerr",
@@ -55,104 +67,45 @@ class ModeItem(GroupItemChild):
             name = self.params_model.item(idx.row(), 0).text()
             win.set_eqn_pixmap(eqn_associations.get(str(name), ""))
 
-        self.params_widget.setMouseTracking(True)
-        self.params_widget.entered.connect(mode_hover_changed)
-        self.params_widget.leaveEvent = lambda e: win.set_eqn_pixmap("")
+        table.setMouseTracking(True)
+        table.entered.connect(mode_hover_changed)
+        table.leaveEvent = lambda e: win.set_eqn_pixmap("")
+        return table
 
-    def tensor_index(self):
-        return self.group.items_list().index(self)
-
-    def operator_on_self(self, op):
-        return self.group.operator_on_indices([(op, self.tensor_index())])
-
-    def destroy(self):
-        return self.operator_on_self(destroy(self.dimension))
-
-    def hamiltonian(self):
-        a = self.destroy()
-        ad = a.dag()
-        f0 = self.frequency
-        k = self.anharmonicity
-        return f0*ad*a + k*ad*ad*a*a
-
-    def drive_hamiltonian(self):
-        a = self.destroy()
-        ad = a.dag()
-        th = pi * self.drive_angle_degrees / 180
-        amp = self.drive_amplitude
-        return amp*(exp(1j*th)*ad + exp(-1j*th)*a)
-
-    def initial_state(self):
-        alpha = self.initial_displacement
-        leg_angle = exp(2j*pi/self.leg_count)
-        init_state = basis(self.dimension, self.fock_state)
-        # leg_phases = list(m.initial_leg_phases)
-        # leg_phases += [1]*(m.initial_leg_count - len(leg_phases))
-        disp_op = lambda n: displace(self.dimension, alpha*leg_angle**n)
-        return sum(disp_op(n)*init_state for n in range(self.leg_count))
-
-    def collapse_ops(self):
-        a = self.destroy()
-        return [self.decay*a, self.dephasing*a.dag()*a]
-
-class ModesGroupItem(GroupItem):
+class ModesGroupItem(ModesModel, GroupItem):
     def __init__(self, setup):
         super(ModesGroupItem, self).__init__("Modes", [("Mode", ModeItem)], setup)
+        self.operator_cache = None
+
+    def add_item(self, *args, **kwargs):
+        self.operator_cache = None
+        return super(ModesGroupItem, self).add_item(*args, **kwargs)
 
-    def operator_on_indices(self, h_idx_pairs):
-        op_list = [qeye(m.dimension) for m in self.items_list()]
-        for h, idx in h_idx_pairs:
-            op_list[idx] = h
-        return tensor(*op_list)
+    def remove_item(self, item):
+        self.operator_cache = None
+        super(ModesGroupItem, self).remove_item(item)
 
     def initial_state(self):
-        return tensor(*[m.initial_state for m in self.items_list()])
+        return qutip.tensor(*[m.initial_state for m in self.items_list()])
 
 
 class CrossModeGroupItem(GroupItem):
     def __init__(self, setup):
-        super(CrossModeGroupItem, self).__init__("Cross-Mode Terms", [("Cross-Mode Term", CrossModeItem)], setup)
-        self.context_menu.add_action('Add Terms From Matrix', self.add_from_matrix)
+        super(CrossModeGroupItem, self).__init__("Cross-Mode Terms", [
+            ("Cross-Mode Term", CrossModeItem),
+            ("Cross-Mode Matrix", CrossModeMatrixItem),
+        ], setup)
 
-        self.array_model = UpperHalfArrayModel()
-        array_view = QTableView()
-        array_view.setModel(self.array_model)
-        type_group = QGroupBox()
-        type_layout = QVBoxLayout(type_group)
-        self.cross_kerr_type_radio = QRadioButton("Cross-Kerr")
-        self.cross_kerr_type_radio.setChecked(True)
-        self.xx_type_radio = QRadioButton("X-X")
-        type_layout.addWidget(self.cross_kerr_type_radio)
-        type_layout.addWidget(self.xx_type_radio)
-        self.dialog = OKCancelDialog(QLabel("Mode Array"), array_view, type_group)
-
-    def add_item(self, dialog=True):
+    def add_item(self, cls=None, dialog=True):
         if self.setup.modes_item.rowCount() < 2:
             message_box.setIcon(QMessageBox.Warning)
             message_box.setText("Need more than two modes")
             message_box.exec_()
         else:
-            return super(CrossModeGroupItem, self).add_item(dialog=dialog)
-
-    def add_from_matrix(self):
-        self.array_model.set_n(self.setup.modes_item.rowCount())
-        names = [m.text() for m in self.setup.modes_item.items_list()]
-        self.array_model.setHorizontalHeaderLabels(names)
-        self.array_model.setVerticalHeaderLabels(names)
-        if self.dialog.exec_():
-            if self.cross_kerr_type_radio.isChecked():
-                type_str = "Cross-Kerr"
-            elif self.xx_type_radio.isChecked():
-                type_str = "X-X"
-            else:
-                return
-            for i, row in enumerate(self.array_model.array):
-                for j, val in enumerate(row):
-                    if val:
-                        self.appendRow(CrossModeItem(type_str, val, i, j, self.setup.modes_item))
+            return super(CrossModeGroupItem, self).add_item(cls, dialog=dialog)
 
 
-class CrossModeItem(GroupItemChild):
+class CrossModeItem(CrossModeModel, GroupItemChild):
     def __init__(self, group, term_type="Cross-Kerr", val=1, mode_1=0, mode_2=1):
         name = term_type + str((mode_1, mode_2))
         super(CrossModeItem, self).__init__(name, [
@@ -162,66 +115,66 @@ class CrossModeItem(GroupItemChild):
             ("mode 2", group.setup.modes_item, None),
         ], group)
 
-    def hamiltonian(self):
-        idx_1 = self.mode_1.tensor_index()
-        idx_2 = self.mode_2.tensor_index()
-        op = num if self.term_type == "Cross-Kerr" else destroy
-        op_1 = op(self.mode_1.dimension)
-        op_2 = op(self.mode_2.dimension)
-        h = self.group.setup.modes_item.operator_on_indices([(op_1, idx_1), (op_2, idx_2)])
-        if self.term_type == "X-X":
-            h += h.dag()
-        return h
+class CrossModeMatrixItem(CrossModeMatrixModel, GroupItemChild):
+    def __init__(self, group, term_type="Cross-Kerr"):
+        super(CrossModeMatrixItem, self).__init__("Coupling_Matrix", [
+            ("term type", ["Cross-Kerr", "X-X"], term_type),
+        ], group)
+        self.array_model = UpperHalfArrayModel()
+        self.sync_modes()
+        modes_emitter = group.setup.modes_item.emitter
+        modes_emitter.item_added.connect(self.mode_added)
+        modes_emitter.item_removed.connect(self.mode_removed)
+
+    @property
+    def coupling(self):
+        return self.array_model.array
+
+    def sync_modes(self):
+        modes = self.group.setup.modes_item.items_list()
+        self.array_model.set_n(len(modes))
+        self.array_model.set_header_labels([m.text() for m in modes])
+
+    def mode_added(self, item):
+        self.sync_modes()
+
+    def mode_removed(self, idx):
+        self.array_model.remove_index(idx)
+        self.sync_modes()
+
+    def delete_self(self):
+        super(CrossModeMatrixItem, self).delete_self()
+        if self not in self.group.item_rows:
+            modes_emitter = self.group.setup.modes_item.emitter
+            modes_emitter.item_added.disconnect(self.mode_added)
+            modes_emitter.item_removed.disconnect(self.mode_removed)
+
+    def build_params_widget(self):
+        self.sync_modes()
+        array_view = QTableView()
+        array_view.setModel(self.array_model)
+        params_widget = QWidget()
+        params_layout = QVBoxLayout(params_widget)
+        params_layout.addWidget(super(CrossModeMatrixItem, self).build_params_widget())
+        params_layout.addWidget(QLabel("Coupling Matrix"))
+        params_layout.addWidget(array_view)
+        return params_widget
+
+    def save_state(self):
+        state = super(CrossModeMatrixItem, self).save_state()
+        state["coupling"] = self.array_model.array.copy()
+        return state
+
+    def load_state(self, state):
+        super(CrossModeMatrixItem, self).load_state(state)
+        self.array_model.set_array(state["coupling"])
+        self.sync_modes()
 
 class OutputsGroupItem(GroupItem):
     def __init__(self, setup):
         super(OutputsGroupItem, self).__init__("Outputs", [("Output", OutputItem)], setup)
 
-class MyImageView(ImageView):
-    def __init__(self):
-        super(MyImageView, self).__init__()
-        self.ui.histogram.gradient.restoreState(
-            {"ticks": [(0.0, (255, 0, 0)), (0.5, (255, 255, 255)), (1.0, (0, 0, 255))], "mode": "rgb"}
-        )
-        self.h_line = InfiniteLine(pos=0, angle=0)
-        self.v_line = InfiniteLine(pos=0, angle=90)
-        self.view.addItem(self.h_line)
-        self.view.addItem(self.v_line)
-        win.time_slider.valueChanged.connect(self.set_time)
-
-    def setImage(self, img, **kwargs):
-        super(MyImageView, self).setImage(img, **kwargs)
-        self.v_line.setPos(img.shape[1]/2.)
-        self.h_line.setPos(img.shape[2]/2.)
-        max_value = abs(img).max()
-        self.setLevels(-max_value, max_value)
-        win.time_slider.setMaximum(len(kwargs['xvals'])-1)
-
-    def set_time(self, time_idx):
-        self.setCurrentIndex(time_idx)
-
-
-class TimePlot(PlotWidget):
-    def __init__(self, *args, **kwargs):
-        super(TimePlot, self).__init__(*args, **kwargs)
-        self.add_line()
-        win.time_slider.valueChanged.connect(self.set_time)
-
-    def add_line(self):
-        self.time_vline = InfiniteLine(angle=90)
-        self.addItem(self.time_vline)
-
-    def plot(self, x, *args, **kwargs):
-        self.time_pts = x
-        win.time_slider.setMaximum(len(self.time_pts)-1)
-        self.plotItem.plot(x, *args, **kwargs)
-
-    def set_time(self, time_idx):
-        pos = self.time_pts[time_idx]
-        self.time_vline.setPos(pos)
-
-
-class OutputItem(GroupItemChild):
+class OutputItem(OutputModel, GroupItemChild):
     def __init__(self, group):
         super(OutputItem, self).__init__("Output_1", [
             ("simulation", group.setup.sims_item, group.setup.sims_item.items_list()[0].name()),
@@ -229,79 +182,96 @@ class OutputItem(GroupItemChild):
             ("report type", ["Wigner", "Expect-XYZ"], "Wigner"),
             ("wigner range", float, 5),
             ("wigner resolution", int, 100),
+            ("wigner processes", int, 1),
         ], group)
 
         self.context_menu.add_action("Re-Compute", self.compute)
         self.data = None
+        self.errors = None
         self.dock = None
         self.plot = None
 
-    def compute(self):
-        win.set_status("Computing Output %s" % self.name())
-        output_steps = []
-        if self.report_type == "Wigner":
-            dx = self.wigner_range
-            nx = self.wigner_resolution
-            axis = linspace(-dx, dx, nx)
-            step_function = lambda state: wigner(state, axis, axis)
-        else:
-            dim = self.mode.dimension
-            a = destroy(dim)
-            ad = a.dag()
-            ops = [a + ad, 1j*(a - ad), a*ad]
-            step_function = lambda state: [expect(op, state) for op in ops]
-
-        n_states = len(self.simulation.states)
-        for i, s in enumerate(self.simulation.states):
-            output_steps.append(step_function(s.ptrace(self.mode.tensor_index())))
-            win.set_progress(100*float(i)/n_states)
-        win.set_progress(0)
-        win.set_status("")
+    def save_state(self):
+        state = super(OutputItem, self).save_state()
+        state.update(data=self.data, errors=self.errors)
+        return state
 
-        if output_steps:
-            self.data = np.array(output_steps)
+    def load_state(self, state):
+        super(OutputItem, self).load_state(state)
+        self.data = state["data"]
+        self.errors = state["errors"]
+        if self.data is not None and len(self.data):
             if self.report_type == "Wigner":
                 self.plot_wigner()
-            elif self.report_type == "Expect-XYZ":
+            else:
                 self.plot_xyz()
 
+    def compute(self, timings=None):
+        # Recorded with the simulation's latest run unless computed as part of one
+        standalone = timings is None
+        if standalone:
+            timings = self.simulation.timings
+        win.set_status("Computing Output %s" % self.name())
+        output_steps, self.errors = self.output_data(timings)
+        win.set_progress(0)
+        win.set_status("")
+
+        if output_steps is None:
+            # The simulation streamed only what other outputs asked for, so re-run it with ours registered
+            self.group.setup.compute(self.simulation)
+            return
+        if len(output_steps):
+            with timed(timings, "plot"):
+                if self.report_type == "Wigner":
+                    self.data = output_steps
+                    self.plot_wigner()
+                elif self.report_type == "Expect-XYZ":
+                    self.data = output_steps
+                    self.plot_xyz()
+        if standalone:
+            win.show_timings(timings)
+
     def plot_type(self):
         return {
-            "Wigner": MyImageView,
-            "Expect-XYZ": TimePlot,
+            "Wigner": plots.MyImageView,
+            "Expect-XYZ": plots.TimePlot,
         }[self.report_type]
 
     def check_dock(self):
         if self.plot is not None:
             self.plot.setParent(None)
-        self.plot = self.plot_type()()
+        self.plot = self.plot_type()(win.time_slider)
         if self.dock is None:
-            self.dock = Dock(self.name(), widget=self.plot)
-            win.outputs_dock_area.addDock(self.dock)
+            self.dock = plots.Dock(self.name(), widget=self.plot)
+            win.outputs_area().addDock(self.dock)
         else:
             self.dock.addWidget(self.plot)
 
     def plot_wigner(self):
-        if not isinstance(self.plot, ImageView):
+        if not isinstance(self.plot, plots.ImageView):
             self.check_dock()
-        self.plot.setImage(self.data, xvals=array(self.simulation.times))
+        self.plot.set_frames(self.data)
 
     # TODO: Bloch/XYZ plot output implementation
     def plot_xyz(self):
-        if not isinstance(self.plot, PlotWidget):
+        if not isinstance(self.plot, plots.PlotWidget):
             self.check_dock()
         self.plot.clear()
         self.plot.add_line()
         self.plot.addLegend()
-        for trace, name, pen in zip(self.data.transpose(), 'XYZ', pen_generator()):
+        for trace, name, pen in zip(self.data.transpose(), 'XYZ', plots.pen_generator()):
             self.plot.plot(self.simulation.times, trace, pen=pen, name=name)
+        if self.errors is not None and len(self.errors) == len(self.data):
+            times = np.array(self.simulation.times)
+            for trace, error, pen in zip(self.data.transpose(), self.errors.transpose(), plots.pen_generator()):
+                self.plot.addItem(plots.ErrorBarItem(x=times, y=trace, height=2*error, pen=pen))
 
 class PulseGroupItem(GroupItem):
     def __init__(self, setup):
         super(PulseGroupItem, self).__init__("Pulses", [("Pulse", PulseItem)], setup)
         #self.setIcon(QIcon("icons/pulse.png"))
 
-class PulseItem(GroupItemChild):
+class PulseItem(PulseModel, GroupItemChild):
     def __init__(self, group):
         super(PulseItem, self).__init__("Pulse_1", [
             ("frequency", float, 1),
@@ -312,35 +282,17 @@ class PulseItem(GroupItemChild):
             ("sigma", float, 1),
         ], group)
 
-    def mesolve_args(self):
-        return {
-            'amp': self.amplitude,
-            'omega': self.frequency,
-            'phase': self.phase,
-            't0': self.duration/2.,
-            'sigma': self.sigma,
-        }
-
-    def time_dependence(self):
-        td_str = "amp*cos(omega * t + phase)"
-        if self.profile == "Gaussian":
-            td_str += "*exp((t-t0)**2/sigma**2)"
-        return td_str
-
-    def hamiltonian(self, modes):
-        modes_item = self.group.setup.modes_item
-        h = sum(m.drive_hamiltonian() for m in modes_item.items_list())
-        return [h, self.time_dependence()]
-
-
 class SequencesGroupItem(GroupItem):
     def __init__(self, setup):
         super(SequencesGroupItem, self).__init__("Pulse Sequences", [("Sequence", SequenceItem)], setup)
 
 
-class SequenceItem(GroupItemChild):
+class SequenceItem(SequenceModel, GroupItemChild):
     def __init__(self, group):
         super(SequenceItem, self).__init__("Sequence_1", [], group)
+        self.n_steps = 0
+
+    def build_params_widget(self):
         add_pulse_button = QPushButton("Add Pulse")
         add_wait_button = QPushButton("Add Wait")
         add_item_layout = QHBoxLayout()
@@ -350,10 +302,9 @@ class SequenceItem(GroupItemChild):
         add_wait_button.clicked.connect(self.add_wait)
         params_widget = QWidget()
         params_layout = QVBoxLayout(params_widget)
-        params_layout.addWidget(self.params_widget)
+        params_layout.addWidget(super(SequenceItem, self).build_params_widget())
         params_layout.addLayout(add_item_layout)
-        self.params_widget = params_widget
-        self.n_steps = 0
+        return params_widget
 
     def add_pulse(self):
         self.n_steps += 1
@@ -363,23 +314,14 @@ class SequenceItem(GroupItemChild):
         self.n_steps += 1
         self.add_field("Wait Step %d" % self.n_steps, float, 1)
 
-    def get_steps(self):
-        steps = []
-        for i in range(1, self.n_steps + 1):
-            try:
-                pulse_item = self.__getattr__("pulse_step_%d" % i)
-                steps.append(
-                    (pulse_item.hamiltonian(self.group.setup.modes_item.items_list()),
-                     pulse_item.duration,  pulse_item.mesolve_args())
-                )
-            except AttributeError as e:
-                try:
-                    wait_time = self.__getattr__("wait_step_%d" % i)
-                except AttributeError:
-                    raise e
-                steps.append((None, wait_time, {}))
-        return steps
-
+    def load_state(self, state):
+        # Steps are fields added on demand, so they are recreated before their values are set
+        for method_name, _ in state["fields"]:
+            if method_name.startswith("pulse_step_"):
+                self.add_pulse()
+            elif method_name.startswith("wait_step_"):
+                self.add_wait()
+        super(SequenceItem, self).load_state(state)
 
 class SimulationsGroupItem(GroupItem):
     def __init__(self, setup):
@@ -387,41 +329,150 @@ class SimulationsGroupItem(GroupItem):
 
 # TODO: Better name than Simulation
 # TODO: Simple Simulations & Sequence Simulations
-class SimulationItem(GroupItemChild):
+class SimulationItem(SimulationModel, GroupItemChild):
     def __init__(self, group):
         super(SimulationItem, self).__init__("Simulation_1", [
             #("time", float, 10),
             ("sequence", group.setup.sequences_item, None),
             ("time step", float, 0.1),
+            ("keep full states", ["No", "In Memory", "On Disk"], "No"),
+            ("trace processes", int, 1),
+            ("solve sequence as", ["Single Compiled Solve", "One Solve Per Step"], "Single Compiled Solve"),
+            ("frame", ["Lab", "Rotating At Mode Frequencies", "Rotating At Drive Frequency"], "Lab"),
+            ("outputs in lab frame", ["No", "Yes"], "No"),
+            ("adaptive truncation", ["Off", "On"], "Off"),
+            ("truncation tolerance", float, 1e-4),
+            ("solver", ["Master Equation", "Monte Carlo"], "Master Equation"),
+            ("trajectories per batch", int, 50),
+            ("max trajectories", int, 1000),
+            ("target precision", float, 1e-3),
         ], group)
         self.dirty = True
+        self.result = None
+        self.result_frame = None
+        self.reduced_cache = {}
+        self.pending_compute = None
         self.states = None
+        self.result_key = None
+        self.worker = None
+        self.timings = None
         self.context_menu.add_action("Compute", lambda: self.group.setup.compute(self))
-
-    def compute(self, h0, init_state, collapse_ops):
-        self.states = []
-        start_time = 0
-        steps = self.sequence.get_steps()
-        self.times = []
-        if not steps:
+        self.context_menu.add_action("Cancel Compute", self.cancel_compute)
+
+    def save_state(self):
+        state = super(SimulationItem, self).save_state()
+        state.update(result=self.result, result_key=self.result_key, result_frame=self.result_frame,
+                     dirty=self.dirty)
+        return state
+
+    def load_state(self, state):
+        super(SimulationItem, self).load_state(state)
+        self.result = state["result"]
+        self.result_key = state["result_key"]
+        self.result_frame = state["result_frame"]
+        self.dirty = state["dirty"]
+        if self.result is not None:
+            self.times = self.result.times
+            self.states = self.result.states
+
+    def compute(self, on_finished=None, truncation_iteration=0, timings=None):
+        if self.worker is not None:
+            error_message("%s is already being computed" % self.name(), warning=True)
+            return
+        # Truncation re-runs add to the timings of the run that started them
+        if timings is None:
+            timings = RunTimings(self.name())
+        self.timings = timings
+        snapshot = self.snapshot(timings)
+        if not snapshot.steps:
             message_box.setText("No Steps in Sequence to Simulate")
             message_box.exec_()
             return
-        for i, (h1, duration, args) in enumerate(steps):
-            end_time = start_time + duration
-            time_list = arange(start_time, end_time, self.time_step)
-            self.times.extend(list(time_list))
-            if h1 is not None:
-                hamiltonian = [h0, h1]
-            else:
-                hamiltonian = h0
-            win.set_status("Computing States for Step %d..." % (i+1))
-            new_states = mesolve(hamiltonian, init_state, time_list, collapse_ops, [], args).states
-            self.states.extend(new_states)
-            init_state = new_states[-1]
-            start_time = end_time
-            win.set_status("")
-            self.dirty = False
+        with timed(timings, "snapshot hash"):
+            key = snapshot_key(snapshot)
+        self.result_frame = self.frame_frequencies()
+        if not self.dirty and key == self.result_key:
+            if on_finished is not None:
+                on_finished()
+            return
+        self.result = compute_engine.SimulationResult()
+        self.reduced_cache = {}
+        self.times = self.result.times
+        self.states = self.result.states
+        self.dirty = True
+        self.result_key = key
+
+        self.worker = compute_worker.ComputeWorker(snapshot, win.result_cache, timings)
+        self.worker.progress.connect(lambda f: win.set_progress(100*f))
+        self.worker.status.connect(win.set_status)
+        self.worker.step_computed.connect(self.add_step_result)
+        self.worker.finished.connect(lambda result: self.compute_finished(result, on_finished, truncation_iteration))
+        self.worker.cancelled.connect(lambda: win.set_status("%s cancelled" % self.name()))
+        self.worker.failed.connect(lambda msg: error_message(msg, "Computing %s failed" % self.name()))
+        self.worker.done.connect(self.compute_done)
+        win.compute_started(self.worker)
+        self.worker.start()
+
+    def add_step_result(self, step_idx, result):
+        # The worker keeps appending to the same result object, so partial results are visible as they arrive
+        self.result = result
+        self.times = result.times
+        self.states = result.states
+        if self.solver == "Monte Carlo":
+            # Each batch of trajectories replaces the averages, so show how they converge
+            self.reduced_cache = {}
+            win.set_status("%s: %d trajectories" % (self.name(), result.n_trajectories))
+            # Only the cheap expectation outputs follow each batch; Wigner outputs wait for the finished run
+            self.group.setup.compute_outputs(self, report_types=["Expect-XYZ"])
+
+    def compute_finished(self, result, on_finished, truncation_iteration=0):
+        self.result = result
+        self.reduced_cache = {}
+        self.times = result.times
+        self.states = result.states
+        self.dirty = False
+        win.set_status("")
+        win.show_timings(self.timings)
+        if self.adaptive_truncation == "On":
+            self.adapt_truncation(on_finished, truncation_iteration)
+        elif on_finished is not None:
+            on_finished()
+
+    def adapt_truncation(self, on_finished, iteration):
+        # Re-run with every mode resized until the top Fock levels hold less than the tolerance
+        modes = self.group.setup.modes_item.items_list()
+        new_dims = self.suggested_dimensions()
+        if iteration < max_truncation_iterations and new_dims != [m.dimension for m in modes]:
+            for m, dim in zip(modes, new_dims):
+                m.set_value("dimension", dim)
+            self.dirty = True
+            # Started from compute_done, once this run's worker has been released
+            self.pending_compute = lambda: self.compute(on_finished, iteration + 1, self.timings)
+            return
+        dims_str = ", ".join("%s: %d" % (m.name(), m.dimension) for m in modes)
+        if new_dims != [m.dimension for m in modes]:
+            win.set_status("Truncation did not settle after %d runs (%s)" % (iteration + 1, dims_str))
+        else:
+            win.set_status("Settled on dimensions %s" % dims_str)
+        if on_finished is not None:
+            on_finished()
+
+    def compute_done(self):
+        self.worker = None
+        win.set_progress(0)
+        if self.pending_compute is not None:
+            pending_compute, self.pending_compute = self.pending_compute, None
+            pending_compute()
+
+    def cancel_compute(self):
+        if self.worker is not None:
+            self.worker.cancel()
+
+    def reduce_states(self, indices, progress_fn=None):
+        win.set_status("Tracing States of %s" % self.name())
+        super(SimulationItem, self).reduce_states(indices, lambda f: win.set_progress(100*f))
+        win.set_progress(0)
+        win.set_status("")
 
 class SweepsGroupItem(GroupItem):
     def __init__(self, setup):
@@ -429,21 +480,72 @@ class SweepsGroupItem(GroupItem):
             "Sweeps", [("Parameter Sweep", SweepItem)], setup
         )
 
-class SweepItem(GroupItemChild):
+class SweepItem(SweepModel, GroupItemChild):
     def __init__(self, group):
-        param_names = [v.name for v in group.setup.variables.values()]
+        param_names = group.setup.variables.names()
         super(SweepItem, self).__init__("Sweep_1", [
             ("Parameter Name", param_names, param_names[0]),
             ("Initial value", float, 0),
             ("Final value", float, 1),
-            ("Steps", int, 10)
+            ("Steps", int, 10),
+            ("simulation", group.setup.sims_item, None),
         ], group)
+        self.result = None
+        self.worker = None
+        self.context_menu.add_action("Run Sweep", self.run_sweep)
+        self.context_menu.add_action("Cancel Sweep", self.cancel_sweep)
+
+    def save_state(self):
+        state = super(SweepItem, self).save_state()
+        state["result"] = self.result
+        return state
+
+    def load_state(self, state):
+        super(SweepItem, self).load_state(state)
+        self.result = state["result"]
+
+    def run_sweep(self):
+        if self.worker is not None:
+            error_message("%s is already running" % self.name(), warning=True)
+            return
+        values = self.sweep_values()
+        snapshots = self.expand()
+        if not snapshots:
+            error_message("%s has no points to run" % self.name(), warning=True)
+            return
+        if not snapshots[0].steps:
+            message_box.setText("No Steps in Sequence to Simulate")
+            message_box.exec_()
+            return
+        win.set_status("Running Sweep %s over %d points" % (self.name(), len(values)))
+        self.worker = compute_worker.SweepWorker(snapshots, values, cache=win.result_cache)
+        self.worker.progress.connect(lambda f: win.set_progress(100*f))
+        self.worker.finished.connect(self.sweep_finished)
+        self.worker.cancelled.connect(lambda: win.set_status("%s cancelled" % self.name()))
+        self.worker.failed.connect(lambda msg: error_message(msg, "Sweep %s failed" % self.name()))
+        self.worker.done.connect(self.sweep_done)
+        win.compute_started(self.worker)
+        self.worker.start()
+
+    def sweep_finished(self, result):
+        self.result = result
+        win.set_status("")
+
+    def sweep_done(self):
+        self.worker = None
+        win.set_progress(0)
+
+    def cancel_sweep(self):
+        if self.worker is not None:
+            self.worker.cancel()
 
 # TODO: Parametric Sweep Group
-class SetupItem(VarRootItem):
-    def __init__(self):
+class SetupItem(SetupModel, VarRootItem):
+    group_names = ["modes_item", "cross_mode_terms_item", "pulses_item", "sequences_item", "sims_item",
+                   "sweeps_item", "outputs_item"]
+
+    def __init__(self, defaults=True):
         super(SetupItem, self).__init__("Setup")
-        self.variables = {}
         self.modes_item = ModesGroupItem(self)
         self.cross_mode_terms_item = CrossModeGroupItem(self)
         self.pulses_item = PulseGroupItem(self)
@@ -460,6 +562,8 @@ class SetupItem(VarRootItem):
         self.appendRow(self.sweeps_item)
         self.appendRow(self.outputs_item)
 
+        if not defaults:
+            return
         self.modes_item.add_item(dialog=False)
         self.pulses_item.add_item(dialog=False)
         seq = self.sequences_item.add_item(dialog=False)
@@ -468,18 +572,31 @@ class SetupItem(VarRootItem):
 
         seq.add_pulse()
 
-    def compute(self, sim_item):
-        modes = self.modes_item.items_list()
-        H0 = sum(m.hamiltonian() for m in modes) + \
-             sum(t.hamiltonian() for t in self.cross_mode_terms_item.items_list())
-        init_state = tensor(*[m.initial_state() for m in modes])
-        c_ops = sum([m.collapse_ops() for m in modes], [])
-
-        sim_item.compute(H0, init_state, c_ops)
+    def save_state(self):
+        state = super(SetupItem, self).save_state()
+        state["groups"] = [getattr(self, name).save_state() for name in self.group_names]
+        return state
+
+    def load_state(self, state):
+        # Groups load in dependency order, so every item a field names already exists
+        super(SetupItem, self).load_state(state)
+        for name, group_state in zip(self.group_names, state["groups"]):
+            getattr(self, name).load_state(group_state)
+
+    def compute_outputs(self, sim_item, report_types=None):
+        outputs = [o for o in self.outputs_item.items_list() if o.simulation is sim_item
+                   and (report_types is None or o.report_type in report_types)]
+        reductions = compute_engine.Reductions()
+        for output in outputs:
+            output.register_reductions(reductions)
+        with timed(sim_item.timings, "ptrace"):
+            sim_item.reduce_states(reductions.ptrace_indices)
+        for output in outputs:
+            output.compute(sim_item.timings)
+        win.show_timings(sim_item.timings)
 
-        for output in self.outputs_item.items_list():
-            if output.simulation is sim_item:
-                output.compute()
+    def compute(self, sim_item):
+        sim_item.compute(lambda: self.compute_outputs(sim_item))
 
 
 class SetupsModel(QStandardItemModel):
@@ -514,22 +631,37 @@ class SetupsView(ContextMenuStandardTreeView):
         for i in range(item.rowCount()):
             self.expand_item(item.child(i, 0))
 
-    def add_setup(self):
-        item = SetupItem()
+    def setups(self):
+        return [self.model().item(i) for i in range(self.model().rowCount())]
+
+    def add_setup(self, state=None):
+        item = SetupItem(defaults=state is None)
+        if state is not None:
+            item.load_state(state)
         self.model().appendRow(item)
         self.expand_item(item)
         self.resizeColumnToContents(0)
         item.modes_item.emitter.item_created.connect(self.mode_added.emit)
 
 
+def eqn_path(suffix):
+    if suffix:
+        suffix = "_" + suffix
+    return os.path.join("latex", "eqn%s.png" % suffix)
+
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super(MainWindow, self).__init__()
         self.setStyleSheet("QMainWindow::separator {background: lightGray; width: 2px}")
 
         self.tree_widget = SetupsView()
-        self.eqn_widget = ResizableImage("latex/eqn.png", 100, .5, 2)
-        self.outputs_dock_area = DockArea()
+        self.eqn_widget = ResizableImage(eqn_path(""), 100, .5, 2)
+        # Every variant is decoded and scaled in the background, so hovering only swaps pixmaps
+        self.eqn_widget.preload(glob.glob(eqn_path("*")))
+        self.performance_panel = PerformancePanel()
+        self.outputs_dock_area = None
+        self.result_cache = ResultCache()
 
         file_menu = self.menuBar().addMenu("File")
         save_action = QAction("Save", self)
@@ -541,26 +673,27 @@ class MainWindow(QMainWindow):
 
         docks = []
         view_menu = self.menuBar().addMenu("View")
-        for dock_name in ["Project Manager", "Properties", "Equation"]:
+        for dock_name in ["Project Manager", "Properties", "Equation", "Performance"]:
             dock = QDockWidget(dock_name)
             dock.setObjectName(method_style(dock_name))
             view_menu.addAction(dock.toggleViewAction())
             docks.append(dock)
-        self.tree_dock, self.props_dock, self.eqn_dock = docks
+        self.tree_dock, self.props_dock, self.eqn_dock, self.performance_dock = docks
 
         self.tree_dock.setWidget(self.tree_widget)
         self.eqn_dock.setWidget(self.eqn_widget)
-        placeholder = QLabel("No Item Selected")
-        placeholder.setAlignment(Qt.AlignCenter)
-        placeholder.setMinimumSize(200, 100)
-        self.props_dock.setWidget(placeholder)
+        self.performance_dock.setWidget(self.performance_panel)
+        self.show_placeholder()
 
-        self.setCentralWidget(self.outputs_dock_area)
+        self.setCentralWidget(QWidget())
         self.setCorner(Qt.BottomLeftCorner, Qt.LeftDockWidgetArea)
         self.setCorner(Qt.TopLeftCorner, Qt.LeftDockWidgetArea)
         self.addDockWidget(Qt.LeftDockWidgetArea, self.tree_dock)
         self.addDockWidget(Qt.LeftDockWidgetArea, self.props_dock)
         self.addDockWidget(Qt.TopDockWidgetArea, self.eqn_dock)
+        self.addDockWidget(Qt.LeftDockWidgetArea, self.performance_dock)
+        self.tabifyDockWidget(self.props_dock, self.performance_dock)
+        self.props_dock.raise_()
 
         self.tree_widget.add_setup()
         self.tree_widget.clicked.connect(self.set_props_widget)
@@ -569,6 +702,11 @@ class MainWindow(QMainWindow):
         self.progress_bar = QProgressBar()
         self.statusBar().addWidget(self.status_label)
         self.statusBar().addWidget(self.progress_bar, 1)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_computes)
+        self.statusBar().addWidget(self.cancel_button)
+        self.workers = []
 
         time_toolbar = self.addToolBar("Time")
         time_toolbar.addWidget(QLabel("Time"))
@@ -578,16 +716,39 @@ class MainWindow(QMainWindow):
         self.restoreGeometry(settings.value("geometry").toByteArray())
         self.restoreState(settings.value("state").toByteArray(), __ui_version__)
 
+    def outputs_area(self):
+        # Built when the first output is plotted, taking over from the empty central widget
+        if self.outputs_dock_area is None:
+            self.outputs_dock_area = plots.DockArea()
+            self.setCentralWidget(self.outputs_dock_area)
+        return self.outputs_dock_area
+
+    def show_placeholder(self):
+        placeholder = QLabel("No Item Selected")
+        placeholder.setAlignment(Qt.AlignCenter)
+        placeholder.setMinimumSize(200, 100)
+        self.props_dock.setWidget(placeholder)
+
     def set_props_widget(self, index):
         item = self.tree_widget.model().itemFromIndex(index)
         if hasattr(item, "params_widget"):
             self.props_dock.setWidget(item.params_widget)
 
     def set_eqn_pixmap(self, suffix):
-        if suffix:
-            suffix = "_" + suffix
-        path = os.path.join("latex", "eqn%s.png" % suffix)
-        self.eqn_widget.set_file(path)
+        path = eqn_path(suffix)
+        if path != self.eqn_widget.filename:
+            self.eqn_widget.set_file(path)
+
+    def show_timings(self, timings):
+        if timings is not None:
+            self.performance_panel.add_run(timings)
+
+    def report_startup(self, exit_after=False):
+        elapsed = time.time() - startup_time
+        self.set_status("Started in %.2f s" % elapsed)
+        if exit_after:
+            sys.stdout.write("startup_seconds %.3f\n" % elapsed)
+            app.quit()
 
     def set_status(self, msg):
         self.status_label.setText(msg)
@@ -597,16 +758,62 @@ class MainWindow(QMainWindow):
         self.progress_bar.setValue(percent)
         app.processEvents()
 
+    def compute_started(self, worker):
+        self.workers.append(worker)
+        worker.done.connect(lambda: self.compute_done(worker))
+        self.cancel_button.setEnabled(True)
+
+    def compute_done(self, worker):
+        self.workers.remove(worker)
+        self.cancel_button.setEnabled(bool(self.workers))
+
+    def cancel_computes(self):
+        for worker in self.workers:
+            worker.cancel()
+
     def closeEvent(self, ev):
+        for worker in list(self.workers):
+            worker.cancel()
+            worker.thread.wait()
+        self.eqn_widget.cache.stop()
         settings.setValue("geometry", self.saveGeometry())
         settings.setValue("state", self.saveState(__ui_version__))
         return super(MainWindow, self).closeEvent(ev)
 
     def save_configuration(self):
-        pass
+        path = str(QFileDialog.getSaveFileName(self, "Save Project", "", project_filter))
+        if not path:
+            return
+        self.set_status("Saving %s" % path)
+        try:
+            project_file.save_project(path, {
+                "version": __version__,
+                "setups": [setup.save_state() for setup in self.tree_widget.setups()],
+            })
+        except (IOError, OSError) as e:
+            error_message(str(e), "Saving %s failed" % path)
+        self.set_status("")
 
     def load_configuration(self):
-        pass
+        if self.workers:
+            error_message("Cancel running computations before loading a project", warning=True)
+            return
+        path = str(QFileDialog.getOpenFileName(self, "Load Project", "", project_filter))
+        if not path:
+            return
+        try:
+            project = project_file.load_project(path)
+        except (IOError, OSError, ValueError) as e:
+            error_message(str(e), "Loading %s failed" % path)
+            return
+        self.show_placeholder()
+        if self.outputs_dock_area is not None:
+            for dock in self.outputs_dock_area.findChildren(plots.Dock):
+                dock.close()
+        model = self.tree_widget.model()
+        model.removeRows(0, model.rowCount())
+        for setup_state in project["setups"]:
+            self.tree_widget.add_setup(setup_state)
 
 
 if __name__ == '__main__':
@@ -618,4 +825,7 @@ if __name__ == '__main__':
     message_box = QMessageBox()
     timer = QTimer()
     timer.singleShot(1, lambda: win.raise_())
+    # Time from process start to the first pass of the event loop, with the window shown.
+    # --startup-time prints it and exits, for tracking launch time from scripts
+    timer.singleShot(0, lambda: win.report_startup(exit_after="--startup-time" in sys.argv))
     sys.exit(app.exec_())
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import shutil
+import tempfile
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+default_cache_dir = os.path.join(os.path.expanduser("~"), ".qutip_explorer", "cache")
+default_max_bytes = 2**30
+
+
+def hash_qobj(h, qobj):
+    h.update(repr((qobj.type, qobj.dims)).encode())
+    data = qobj.data.tocsr()
+    data.sort_indices()
+    for arr in (data.data, data.indices, data.indptr):
+        h.update(arr.tostring())
+
+
+def hash_value(h, value):
+    if hasattr(value, "dims") and hasattr(value, "data"):
+        hash_qobj(h, value)
+    elif hasattr(value, "key_items"):
+        hash_value(h, value.key_items())
+    elif isinstance(value, (list, tuple)):
+        h.update(("%s%d" % (type(value).__name__, len(value))).encode())
+        for v in value:
+            hash_value(h, v)
+    elif isinstance(value, dict):
+        h.update(("dict%d" % len(value)).encode())
+        for k in sorted(value):
+            hash_value(h, k)
+            hash_value(h, value[k])
+    else:
+        h.update(repr(value).encode())
+
+
+def snapshot_key(snapshot):
+    h = hashlib.sha1()
+    hash_value(h, [snapshot.h0, snapshot.init_state, snapshot.collapse_ops, snapshot.steps, snapshot.time_step,
+                  snapshot.reductions, snapshot.compiled, snapshot.h0_args, snapshot.monte_carlo])
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    # Content-addressed store of simulation results, evicting least recently used entries past max_bytes
+    def __init__(self, path=default_cache_dir, max_bytes=default_max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def filename(self, key):
+        return os.path.join(self.path, key + ".pkl")
+
+    def frames_dir(self, key):
+        # Chunk files of a result whose states were spooled to disk, kept beside its pickle
+        return os.path.join(self.path, key + ".frames")
+
+    def get(self, key):
+        filename = self.filename(key)
+        try:
+            with open(filename, "rb") as f:
+                result = pickle.load(f)
+            # mtime doubles as the last access time for eviction
+            os.utime(filename, None)
+            states = getattr(result, "states", None)
+            if hasattr(states, "copy_to"):
+                if not os.path.isdir(getattr(states, "directory", "")):
+                    return None
+                # Copied out (hard linked where possible) so eviction cannot pull the files from under the result
+                result.states = states.copy_to(tempfile.mkdtemp(prefix="qutip_explorer_"))
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return result
+
+    def put(self, key, result):
+        # Write then rename so concurrent pool workers never see partial entries
+        states = getattr(result, "states", None)
+        frames_tmp = None
+        if hasattr(states, "copy_to"):
+            # States on disk are cached as chunk files, never pickled into memory,
+            # and not at all if they alone would fill the cache
+            if states.disk_bytes() > self.max_bytes:
+                return
+            frames_tmp = tempfile.mkdtemp(dir=self.path, suffix=".tmp")
+            cached = result.__class__.__new__(result.__class__)
+            cached.__dict__.update(result.__dict__)
+            cached.states = states.copy_to(frames_tmp, owned=False)
+            cached.states.directory = self.frames_dir(key)
+            result = cached
+        fd, tmp_name = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+            self.remove(key)
+            if frames_tmp is not None:
+                os.rename(frames_tmp, self.frames_dir(key))
+            os.rename(tmp_name, self.filename(key))
+        except (IOError, OSError):
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            if frames_tmp is not None:
+                shutil.rmtree(frames_tmp, ignore_errors=True)
+            return
+        self.evict()
+
+    def remove(self, key):
+        if os.path.exists(self.filename(key)):
+            os.remove(self.filename(key))
+        shutil.rmtree(self.frames_dir(key), ignore_errors=True)
+
+    def entry_size(self, name):
+        size = os.stat(os.path.join(self.path, name)).st_size
+        frames_dir = self.frames_dir(name[:-len(".pkl")])
+        if os.path.isdir(frames_dir):
+            size += sum(os.path.getsize(os.path.join(frames_dir, f)) for f in os.listdir(frames_dir))
+        return size
+
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".pkl"):
+                continue
+            try:
+                mtime = os.stat(os.path.join(self.path, name)).st_mtime
+                entries.append((mtime, self.entry_size(name), name))
+            except OSError:
+                continue
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        while entries and total > self.max_bytes:
+            _, size, name = entries.pop(0)
+            try:
+                self.remove(name[:-len(".pkl")])
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, name in self.entries():
+            try:
+                self.remove(name[:-len(".pkl")])
+            except OSError:
+                pass
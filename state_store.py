@@ -0,0 +1,155 @@
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from numpy import memmap, asarray, empty
+from qutip import Qobj
+
+
+class FrameStore(object):
+    # Append-only sequence of equally shaped arrays, written to chunked memory-mapped files.
+    # The most recently touched chunks stay mapped so neighbouring frames are cheap to revisit.
+    def __init__(self, frame_shape=None, dtype=float, chunk_size=64, cached_chunks=8, directory=None):
+        self.frame_shape = None if frame_shape is None else tuple(frame_shape)
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.cached_chunks = cached_chunks
+        self.directory = tempfile.mkdtemp(prefix="qutip_explorer_", dir=directory)
+        self.n_frames = 0
+        self.n_chunks = 0
+        self.chunks = OrderedDict()
+        self.max_abs = 0
+        # Only the owning store removes the chunk files; see hand_over and copy_to
+        self.owned = True
+        self.handed_over = False
+
+    def chunk_filename(self, chunk_idx):
+        return os.path.join(self.directory, "chunk_%d.dat" % chunk_idx)
+
+    def chunk(self, chunk_idx):
+        if chunk_idx in self.chunks:
+            chunk = self.chunks.pop(chunk_idx)
+        else:
+            if chunk_idx == self.n_chunks:
+                mode = "w+"
+                self.n_chunks += 1
+            else:
+                mode = "r+"
+            chunk = memmap(self.chunk_filename(chunk_idx), dtype=self.dtype, mode=mode,
+                           shape=(self.chunk_size,) + self.frame_shape)
+        self.chunks[chunk_idx] = chunk
+        while len(self.chunks) > self.cached_chunks:
+            _, old_chunk = self.chunks.popitem(last=False)
+            old_chunk.flush()
+        return chunk
+
+    def append(self, frame):
+        frame = asarray(frame)
+        if self.frame_shape is None:
+            self.frame_shape = frame.shape
+        chunk_idx, i = divmod(self.n_frames, self.chunk_size)
+        self.chunk(chunk_idx)[i] = frame
+        self.max_abs = max(self.max_abs, abs(frame).max())
+        self.n_frames += 1
+
+    def extend(self, frames):
+        for frame in frames:
+            self.append(frame)
+
+    def frame(self, n):
+        if n < 0:
+            n += self.n_frames
+        if not 0 <= n < self.n_frames:
+            raise IndexError(n)
+        chunk_idx, i = divmod(n, self.chunk_size)
+        return self.chunk(chunk_idx)[i]
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(self.n_frames))]
+        return self.frame(n)
+
+    def __iter__(self):
+        for n in range(self.n_frames):
+            yield self[n]
+
+    def array(self):
+        frames = empty((self.n_frames,) + (self.frame_shape or ()), dtype=self.dtype)
+        for n in range(self.n_frames):
+            frames[n] = self.frame(n)
+        return frames
+
+    def flush(self):
+        for chunk in self.chunks.values():
+            chunk.flush()
+
+    def disk_bytes(self):
+        return sum(os.path.getsize(self.chunk_filename(i)) for i in range(self.n_chunks))
+
+    def copy_to(self, directory, owned=True):
+        # Another store over copies of the chunk files in directory (hard links where possible),
+        # so the copy stays valid after this store is closed
+        self.flush()
+        for chunk_idx in range(self.n_chunks):
+            source = self.chunk_filename(chunk_idx)
+            target = os.path.join(directory, os.path.basename(source))
+            try:
+                os.link(source, target)
+            except (OSError, AttributeError):
+                shutil.copyfile(source, target)
+        copy = self.__class__.__new__(self.__class__)
+        copy.__setstate__(self.__getstate__())
+        copy.directory = directory
+        copy.owned = owned
+        return copy
+
+    def hand_over(self):
+        # The next unpickled copy (e.g. a pool result sent back to the parent) takes over the chunk files
+        self.owned = False
+        self.handed_over = True
+
+    def close(self):
+        self.chunks.clear()
+        if self.owned:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    # Pickled by reference: only the location of the chunk files travels, never the frames themselves.
+    # The unpickled copy reads the same files and leaves them in place unless they were handed over
+    def __getstate__(self):
+        self.flush()
+        state = dict(self.__dict__)
+        del state["chunks"]
+        state["owned"] = self.handed_over
+        state["handed_over"] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.chunks = OrderedDict()
+
+
+class StateStore(FrameStore):
+    # Frames are dense state matrices, handed back as Qobj on access
+    def __init__(self, dims=None, **kwargs):
+        kwargs.setdefault("dtype", complex)
+        super(StateStore, self).__init__(**kwargs)
+        self.dims = dims
+
+    def append(self, state):
+        if self.dims is None:
+            self.dims = state.dims
+        super(StateStore, self).append(state.full())
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(self.n_frames))]
+        return Qobj(self.frame(n), dims=self.dims)
@@ -0,0 +1,43 @@
+import unittest
+
+try:
+    from PyQt4.QtGui import QApplication
+except ImportError:
+    QApplication = None
+
+
+@unittest.skipIf(QApplication is None, "needs PyQt4")
+class GroupRenameTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from qutip_explorer import SetupsModel
+        from interface_helpers import GroupItem, GroupItemChild
+
+        class Child(GroupItemChild):
+            def __init__(self, group):
+                super(Child, self).__init__("Child_1", [], group)
+
+        cls.app = QApplication.instance() or QApplication([])
+        cls.model = SetupsModel()
+        cls.group = GroupItem("Children", [("Child", Child)], None)
+        cls.model.appendRow(cls.group)
+
+    def test_rename_in_tree(self):
+        child = self.group.add_item(dialog=False)
+        old_name = child.name()
+        # Same path as an edit in the tree view: the item text changes first
+        child.setText("Renamed_In_Tree")
+        self.assertIs(self.group.item_from_name("Renamed_In_Tree"), child)
+        self.assertIsNone(self.group.item_from_name(old_name))
+
+    def test_rename_in_form(self):
+        child = self.group.add_item(dialog=False)
+        old_name = child.name()
+        child.params_model.item(0, 1).setText("Renamed_In_Form")
+        self.assertEqual(child.name(), "Renamed_In_Form")
+        self.assertIs(self.group.item_from_name("Renamed_In_Form"), child)
+        self.assertIsNone(self.group.item_from_name(old_name))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class RunTimings(object):
+    # Wall-clock seconds spent in each stage of one compute run, and the peak size of its stored states.
+    # Stages are added from both the GUI and the worker thread, hence the lock
+    def __init__(self, label):
+        self.label = label
+        self.started = time.time()
+        self.stages = OrderedDict()
+        self.peak_state_bytes = 0
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            count, total, longest = self.stages.get(stage, (0, 0., 0.))
+            self.stages[stage] = (count + 1, total + seconds, max(longest, seconds))
+
+    def record_states(self, states):
+        n_bytes = stored_bytes(states)
+        with self.lock:
+            self.peak_state_bytes = max(self.peak_state_bytes, n_bytes)
+
+    def total_seconds(self):
+        return sum(total for _, total, _ in self.stages.values())
+
+    def as_dict(self):
+        with self.lock:
+            stages = [{"stage": stage, "calls": count, "seconds": total, "max_seconds": longest}
+                      for stage, (count, total, longest) in self.stages.items()]
+        return {
+            "label": self.label,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "total_seconds": sum(s["seconds"] for s in stages),
+            "peak_state_bytes": self.peak_state_bytes,
+            "stages": stages,
+        }
+
+    def save_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+
+@contextmanager
+def timed(timings, stage):
+    # Does nothing when timings is None, so instrumented code runs the same without a recorder
+    if timings is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings.add(stage, time.time() - start)
+
+
+def stored_bytes(states):
+    # Memory held by a result's states: the mapped chunks of a store spooled to disk,
+    # or the arrays of each Qobj in a list (sparse, or dense complex)
+    if hasattr(states, "chunks"):
+        return sum(chunk.nbytes for chunk in states.chunks.values())
+    n_bytes = 0
+    for state in states:
+        data = state.data
+        if hasattr(data, "indptr"):
+            n_bytes += data.data.nbytes + data.indices.nbytes + data.indptr.nbytes
+        else:
+            n_bytes += state.shape[0] * state.shape[1] * 16
+    return n_bytes
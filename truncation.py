@@ -0,0 +1,27 @@
+from numpy import array, real, cumsum
+
+max_truncation_iterations = 5
+
+
+def level_populations(reduced_states):
+    # (n_times, dimension) Fock level populations of a single mode
+    return array([real(s.diag()) for s in reduced_states])
+
+
+def tail_populations(reduced_states):
+    # tails[k] is the largest population, over the run, found at or above level k
+    pops = level_populations(reduced_states)
+    return cumsum(pops[:, ::-1], axis=1)[:, ::-1].max(axis=0)
+
+
+def suggest_dimension(reduced_states, tolerance, min_dimension=2):
+    tails = tail_populations(reduced_states)
+    dim = len(tails)
+    if tails[-1] > tolerance:
+        # Population leaked into the top level, so the truncation is distorting the dynamics
+        return dim + max(2, dim // 2)
+    # Smallest dimension whose top level (and everything that was above it) stayed below tolerance
+    for new_dim in range(min_dimension, dim + 1):
+        if tails[new_dim - 1] < tolerance:
+            return new_dim
+    return dim